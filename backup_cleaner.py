@@ -1,9 +1,17 @@
 import os
+import re
+import fnmatch
 import sys
+import types
 import xxhash
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
-from tkinter.font import Font
+if __name__ == "__mp_main__":
+    # Spawned pool workers run this script again (as __mp_main__) before taking tasks,
+    # which only use backup_worker: the GUI toolkit is not loaded there
+    tk = types.SimpleNamespace(Tk=object)
+else:
+    import tkinter as tk
+    from tkinter import ttk, filedialog, messagebox
+    from tkinter.font import Font
 import shutil
 from pathlib import Path
 import collections
@@ -12,8 +20,254 @@ import queue
 import time
 import itertools
 import datetime
+import concurrent.futures
+import json
+import csv
+import sqlite3
+import argparse
+import pickle
+import tempfile
+import multiprocessing
 from multiprocessing import Pool, cpu_count
 
+import backup_worker
+from backup_worker import IOThrottle, TREE_HASH_MIN_SIZE, TREE_HASH_RANGE_SIZE, MANIFEST_DIGEST_TYPE
+
+# Folder for resumable state (compare checkpoints) kept next to the script
+STATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".backup_cleaner")
+
+# Largest number of files handed to a worker at once; also the checkpoint granularity
+MAX_BATCH_SIZE = 500
+
+# Minimum number of seconds between checkpoint fsyncs
+CHECKPOINT_INTERVAL = 5.0
+
+# Write-ahead journal of planned and completed actions
+JOURNAL_PATH = os.path.join(STATE_DIR, "actions_journal.jsonl")
+
+# Number of completed actions recorded between journal fsyncs
+JOURNAL_SYNC_EVERY = 100
+
+# Measured throughput of recent action runs, used by the plan cost estimator
+THROUGHPUT_HISTORY_PATH = os.path.join(STATE_DIR, "throughput.json")
+THROUGHPUT_HISTORY_RUNS = 20
+
+# Ignore device pairs with less data than this; small copies are dominated by latency
+MIN_MEASURED_BYTES = 64 * 1024 * 1024
+
+# Assumed throughput when nothing has been measured yet
+DEFAULT_COPY_BYTES_PER_SECOND = 100 * 1024 * 1024
+DEFAULT_METADATA_OPS_PER_SECOND = 500
+
+# Plans copying longer than SLOW_PLAN_SECONDS to a disk slower than this are flagged
+SLOW_DISK_BYTES_PER_SECOND = 50 * 1024 * 1024
+SLOW_PLAN_SECONDS = 10 * 60
+
+# Threads listing directories in parallel_walk, and how many listings may be started
+# ahead of the walk (high-latency filesystems like NFS/SMB)
+WALK_THREADS = 16
+WALK_MAX_IN_FLIGHT = 1024
+
+# Quick mode verifies rows in small batches, so the rows that could reclaim the most
+# bytes are verified (and updated in the view) first
+QUICK_VERIFY_BATCH_SIZE = 20
+
+# Buffer of verified copies, which hash the data while copying it
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+
+
+class FilterRules:
+    """Include/exclude rules and size limits applied while walking a folder.
+    
+    Patterns are globs, or regular expressions when prefixed with "re:". A glob
+    containing "/" is matched against the path relative to the scanned folder,
+    otherwise against the name; regular expressions are searched in the relative
+    path (always with "/" separators). Exclude rules prune directories during the
+    walk, so excluded subtrees are never descended into. Include rules and the
+    size limits apply to files. Skipped files, bytes and pruned directories are
+    counted per rule in `skipped`.
+    """
+    
+    def __init__(self, include=(), exclude=(), min_size=None, max_size=None):
+        self.include = [self._compile(pattern) for pattern in include]
+        self.exclude = [self._compile(pattern) for pattern in exclude]
+        self.min_size = min_size
+        self.max_size = max_size
+        self.skipped = collections.defaultdict(lambda: {"files": 0, "bytes": 0, "dirs": 0})
+    
+    @staticmethod
+    def parse_patterns(text):
+        """Split a ';' or newline separated list of patterns."""
+        return [pattern.strip() for pattern in re.split(r'[;\n]', text) if pattern.strip()]
+    
+    @staticmethod
+    def _compile(pattern):
+        """Compile a pattern into (label, regex, matches_relative_path). Raises re.error."""
+        flags = re.IGNORECASE if os.name == 'nt' else 0
+        if pattern.startswith("re:"):
+            return pattern, re.compile(pattern[3:], flags).search, True
+        return pattern, re.compile(fnmatch.translate(pattern), flags).match, "/" in pattern
+    
+    def is_active(self):
+        return bool(self.include or self.exclude or self.min_size is not None or self.max_size is not None)
+    
+    @staticmethod
+    def _matching_rule(rules, rel_path, name):
+        rel_path = rel_path.replace(os.sep, "/")
+        for label, match, on_path in rules:
+            if match(rel_path if on_path else name):
+                return label
+        return None
+    
+    def prune_dirs(self, rel_root, dirnames):
+        """Remove excluded directories from dirnames in place (for a top-down walk)."""
+        if not self.exclude:
+            return
+        kept = []
+        for name in dirnames:
+            rule = self._matching_rule(self.exclude, os.path.join(rel_root, name), name)
+            if rule is None:
+                kept.append(name)
+            else:
+                self.skipped[f"exclude {rule}"]["dirs"] += 1
+        dirnames[:] = kept
+    
+    def accept_file(self, path, rel_path, name, size=None):
+        """Return True if the file passes the rules; otherwise count it as skipped.
+        
+        size, when known, saves looking the file up on disk.
+        """
+        if size is None and (self.min_size is not None or self.max_size is not None):
+            size = self._size_of(path)
+        rule = self._matching_rule(self.exclude, rel_path, name)
+        if rule is not None:
+            rule = f"exclude {rule}"
+        elif self.include and self._matching_rule(self.include, rel_path, name) is None:
+            rule = "not included"
+        elif self.min_size is not None or self.max_size is not None:
+            if self.min_size is not None and size < self.min_size:
+                rule = "min size"
+            elif self.max_size is not None and size > self.max_size:
+                rule = "max size"
+        if rule is None:
+            return True
+        
+        self.skipped[rule]["files"] += 1
+        self.skipped[rule]["bytes"] += self._size_of(path) if size is None else size
+        return False
+    
+    @staticmethod
+    def _size_of(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+    
+    def summary(self):
+        """Describe what each rule skipped, one line per rule."""
+        lines = []
+        for rule, counts in sorted(self.skipped.items()):
+            line = f"{rule}: {counts['files']} files ({BackupCleaner.format_size(counts['bytes'])})"
+            if counts["dirs"]:
+                line += f", {counts['dirs']} directories not scanned"
+            lines.append(line)
+        return lines
+
+
+class ActionJournal:
+    """Write-ahead journal for execute_actions.
+    
+    The journal is a JSONL file: a header line with the folders, one "plan" line per
+    operation (all written and fsynced before any file is touched), then a "done" or
+    "failed" line per attempted operation. Completion records are fsynced in batches
+    of JOURNAL_SYNC_EVERY, so after a crash at most that many completed operations are
+    attempted again, which _perform_action tolerates.
+    """
+    
+    def __init__(self, path, origin_folder, target_folder, plan, done, handle):
+        self.path = path
+        self.origin_folder = origin_folder
+        self.target_folder = target_folder
+        self.plan = plan
+        self.done = done
+        self._handle = handle
+        self._unsynced = 0
+    
+    @classmethod
+    def create(cls, path, origin_folder, target_folder, plan):
+        """Start a new journal containing the full plan."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle = open(path, 'w', encoding='utf-8')
+        handle.write(json.dumps({"op": "header", "version": 1,
+                                 "origin_folder": origin_folder,
+                                 "target_folder": target_folder}) + "\n")
+        for entry in plan:
+            handle.write(json.dumps(dict(entry, op="plan")) + "\n")
+        handle.flush()
+        os.fsync(handle.fileno())
+        return cls(path, origin_folder, target_folder, plan, set(), handle)
+    
+    @classmethod
+    def load(cls, path):
+        """Open an existing journal for resuming. Returns None if there is none."""
+        if not os.path.exists(path):
+            return None
+        
+        header = None
+        plan = []
+        done = set()
+        valid_end = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete line")
+                    record = json.loads(line)
+                except ValueError:
+                    # A truncated last line means the run was interrupted mid-write
+                    break
+                valid_end += len(line)
+                if record["op"] == "header":
+                    header = record
+                elif record["op"] == "plan":
+                    plan.append({key: value for key, value in record.items() if key != "op"})
+                elif record["op"] == "done":
+                    done.add(record["seq"])
+        
+        if header is None:
+            os.remove(path)
+            return None
+        
+        # Drop the truncated line, so the records of the resumed run start on a line of their own
+        with open(path, 'r+b') as f:
+            f.truncate(valid_end)
+        handle = open(path, 'a', encoding='utf-8')
+        return cls(path, header["origin_folder"], header["target_folder"], plan, done, handle)
+    
+    def record(self, seq, op, **extra):
+        """Record the outcome of a planned operation."""
+        self._handle.write(json.dumps(dict(extra, op=op, seq=seq)) + "\n")
+        if op == "done":
+            self.done.add(seq)
+        self._unsynced += 1
+        if self._unsynced >= JOURNAL_SYNC_EVERY:
+            self.sync()
+    
+    def sync(self):
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        self._unsynced = 0
+    
+    def close(self):
+        if not self._handle.closed:
+            self.sync()
+            self._handle.close()
+    
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
 class BackupCleaner(tk.Tk):
     def __init__(self):
         super().__init__()
@@ -29,12 +283,31 @@ class BackupCleaner(tk.Tk):
         self.origin_folder_var = tk.StringVar()
         self.target_folder_var = tk.StringVar()
         self.search_different_locations_var = tk.BooleanVar(value=False)
+        self.near_duplicates_var = tk.BooleanVar(value=False)
+        self.target_manifest_var = tk.StringVar()
+        self.quick_mode_var = tk.BooleanVar(value=False)
+        self.same_layout_var = tk.BooleanVar(value=False)
         self.status_var = tk.StringVar(value="Ready")
         self.progress_var = tk.DoubleVar()
         
         # CPU usage control variable
         self.cpu_usage_var = tk.IntVar(value=75)  # Default to 75% of available cores
         
+        # I/O throttling variables (0 = unlimited)
+        self.io_limit_var = tk.DoubleVar(value=0)  # MB/s
+        self.iops_limit_var = tk.IntVar(value=0)  # operations/s
+        self.idle_io_var = tk.BooleanVar(value=False)
+        self.io_throttle = IOThrottle()
+        
+        # Filter rules (patterns separated by ";", "re:" prefix for regular expressions)
+        self.include_var = tk.StringVar()
+        self.exclude_var = tk.StringVar()
+        self.min_size_var = tk.StringVar()  # KB
+        self.max_size_var = tk.StringVar()  # MB
+        self.filter_summary = []
+        self.near_duplicate_bytes = None
+        self.stat_calls_saved = 0
+        
         self.create_widgets()
         
         # Store file data
@@ -43,6 +316,22 @@ class BackupCleaner(tk.Tk):
         # For background processing
         self.processing_queue = queue.Queue()
         self.stop_background_thread = False
+        self.is_comparing = False
+        self.is_paused = False
+        self.close_requested = False
+        
+        # Shared with pool workers: run_event is cleared to pause, cancel_event set to cancel
+        self.run_event = multiprocessing.Event()
+        self.run_event.set()
+        self.cancel_event = multiprocessing.Event()
+        
+        # Long-lived worker pool, created on first use (see get_pool)
+        self._pool = None
+        self._pool_config = None
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        
+        # Finish an interrupted action plan once the window is up
+        self.after(100, self.check_unfinished_journal)
 
     def create_widgets(self):
         # Main container
@@ -71,11 +360,41 @@ class BackupCleaner(tk.Tk):
             text="Search for matches in different locations", 
             variable=self.search_different_locations_var
         )
-        search_option.grid(row=2, column=0, columnspan=3, padx=5, pady=5, sticky=tk.W)
+        search_option.grid(row=2, column=0, columnspan=2, padx=5, pady=5, sticky=tk.W)
+        
+        # Near-duplicate analysis option
+        near_duplicates_option = ttk.Checkbutton(
+            folder_frame,
+            text="Analyze near-duplicates",
+            variable=self.near_duplicates_var
+        )
+        near_duplicates_option.grid(row=2, column=1, columnspan=2, padx=5, pady=5, sticky=tk.E)
+        
+        # Optional target manifest, used instead of scanning and reading the target folder
+        ttk.Label(folder_frame, text="Target Manifest (optional):").grid(row=3, column=0, padx=5, pady=5, sticky=tk.W)
+        manifest_entry = ttk.Entry(folder_frame, textvariable=self.target_manifest_var, width=50)
+        manifest_entry.grid(row=3, column=1, padx=5, pady=5, sticky=tk.W+tk.E)
+        ttk.Button(folder_frame, text="Browse...", command=self.select_target_manifest).grid(row=3, column=2, padx=5, pady=5)
+        
+        # Quick mode: show a metadata-only classification first, then verify it
+        quick_mode_option = ttk.Checkbutton(
+            folder_frame,
+            text="Quick mode (classify by size and date first, verify by hashing in the background)",
+            variable=self.quick_mode_var
+        )
+        quick_mode_option.grid(row=4, column=0, columnspan=2, padx=5, pady=5, sticky=tk.W)
+        
+        # Same layout: compare files at the same relative path only, in one merged walk
+        same_layout_option = ttk.Checkbutton(
+            folder_frame,
+            text="Same layout (list target-only files)",
+            variable=self.same_layout_var
+        )
+        same_layout_option.grid(row=5, column=0, columnspan=2, padx=5, pady=5, sticky=tk.W)
         
         # CPU usage slider
         cpu_label = ttk.Label(folder_frame, text="CPU Usage (%): ")
-        cpu_label.grid(row=3, column=0, padx=(20, 5), pady=5, sticky=tk.W)
+        cpu_label.grid(row=6, column=0, padx=(20, 5), pady=5, sticky=tk.W)
         
         cpu_slider = ttk.Scale(
             folder_frame,
@@ -85,18 +404,46 @@ class BackupCleaner(tk.Tk):
             variable=self.cpu_usage_var,
             length=150
         )
-        cpu_slider.grid(row=3, column=1, padx=5, pady=5, sticky=tk.W)
+        cpu_slider.grid(row=6, column=1, padx=5, pady=5, sticky=tk.W)
         
         # CPU percentage label
         self.cpu_percent_label = ttk.Label(folder_frame, text="75%")
-        self.cpu_percent_label.grid(row=3, column=2, padx=5, pady=5, sticky=tk.W)
+        self.cpu_percent_label.grid(row=6, column=2, padx=5, pady=5, sticky=tk.W)
         
         # Update CPU percentage label when slider value changes
         cpu_slider.bind("<Motion>", self.update_cpu_label)
+        cpu_slider.bind("<ButtonRelease-1>", self.on_cpu_slider_release)
+        
+        # I/O limits, applied immediately to running comparisons and actions
+        ttk.Label(folder_frame, text="I/O Limit: ").grid(row=7, column=0, padx=(20, 5), pady=5, sticky=tk.W)
+        io_frame = ttk.Frame(folder_frame)
+        io_frame.grid(row=7, column=1, columnspan=2, padx=5, pady=5, sticky=tk.W)
+        
+        ttk.Spinbox(io_frame, from_=0, to=10000, increment=10, width=7, textvariable=self.io_limit_var).pack(side=tk.LEFT)
+        ttk.Label(io_frame, text="MB/s").pack(side=tk.LEFT, padx=(2, 10))
+        ttk.Spinbox(io_frame, from_=0, to=100000, increment=100, width=7, textvariable=self.iops_limit_var).pack(side=tk.LEFT)
+        ttk.Label(io_frame, text="ops/s (0 = unlimited)").pack(side=tk.LEFT, padx=(2, 10))
+        ttk.Checkbutton(io_frame, text="Idle I/O priority for workers", variable=self.idle_io_var).pack(side=tk.LEFT)
+        
+        self.io_limit_var.trace_add("write", self.update_io_limits)
+        self.iops_limit_var.trace_add("write", self.update_io_limits)
+        
+        # Include/exclude rules and size limits, applied while scanning
+        ttk.Label(folder_frame, text="Exclude: ").grid(row=8, column=0, padx=(20, 5), pady=5, sticky=tk.W)
+        filter_frame = ttk.Frame(folder_frame)
+        filter_frame.grid(row=8, column=1, columnspan=2, padx=5, pady=5, sticky=tk.W)
+        
+        ttk.Entry(filter_frame, textvariable=self.exclude_var, width=30).pack(side=tk.LEFT)
+        ttk.Label(filter_frame, text="Include:").pack(side=tk.LEFT, padx=(10, 2))
+        ttk.Entry(filter_frame, textvariable=self.include_var, width=20).pack(side=tk.LEFT)
+        ttk.Label(filter_frame, text="Min KB:").pack(side=tk.LEFT, padx=(10, 2))
+        ttk.Entry(filter_frame, textvariable=self.min_size_var, width=7).pack(side=tk.LEFT)
+        ttk.Label(filter_frame, text="Max MB:").pack(side=tk.LEFT, padx=(10, 2))
+        ttk.Entry(filter_frame, textvariable=self.max_size_var, width=7).pack(side=tk.LEFT)
         
         # Progress bar
         progress_frame = ttk.Frame(folder_frame)
-        progress_frame.grid(row=4, column=0, columnspan=3, padx=5, pady=5, sticky=tk.W+tk.E)
+        progress_frame.grid(row=9, column=0, columnspan=3, padx=5, pady=5, sticky=tk.W+tk.E)
         
         self.progress_bar = ttk.Progressbar(progress_frame, variable=self.progress_var, maximum=100)
         self.progress_bar.pack(fill=tk.X, expand=True)
@@ -107,13 +454,20 @@ class BackupCleaner(tk.Tk):
         
         # Action buttons
         button_frame = ttk.Frame(folder_frame)
-        button_frame.grid(row=5, column=0, columnspan=3, padx=5, pady=5)
-        
-        ttk.Button(button_frame, text="Compare Folders", command=self.compare_folders).pack(side=tk.LEFT, padx=5)
-        ttk.Button(button_frame, text="Execute Actions", command=self.execute_actions).pack(side=tk.LEFT, padx=5)
+        button_frame.grid(row=10, column=0, columnspan=3, padx=5, pady=5)
+        
+        self.compare_button = ttk.Button(button_frame, text="Compare Folders", command=self.compare_folders)
+        self.compare_button.pack(side=tk.LEFT, padx=5)
+        self.pause_button = ttk.Button(button_frame, text="Pause", command=self.toggle_pause, state=tk.DISABLED)
+        self.pause_button.pack(side=tk.LEFT, padx=5)
+        self.cancel_button = ttk.Button(button_frame, text="Cancel", command=self.cancel_compare, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+        self.execute_button = ttk.Button(button_frame, text="Execute Actions", command=self.execute_actions)
+        self.execute_button.pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Select All", command=self.select_all).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Deselect All", command=self.deselect_all).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Export to Log", command=self.export_to_log).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Load Session...", command=self.select_session).pack(side=tk.LEFT, padx=5)
         
         # Results TreeView with scrollbar
         self.result_tree_frame = ttk.Frame(main_frame)
@@ -166,6 +520,7 @@ class BackupCleaner(tk.Tk):
         # Configure tags for color highlighting
         self.result_tree.tag_configure("green", foreground="green")
         self.result_tree.tag_configure("blue", foreground="blue")
+        self.result_tree.tag_configure("purple", foreground="purple")
 
     def select_origin_folder(self):
         folder = filedialog.askdirectory(title="Select Origin Folder")
@@ -177,26 +532,204 @@ class BackupCleaner(tk.Tk):
         if folder:
             self.target_folder_var.set(folder)
 
-    def count_files_in_directory(self, directory):
-        """Count files in a directory without loading all files in memory."""
-        file_count = 0
-        batch_size = 1000  # Process in batches to prevent memory issues
-        
+    def select_target_manifest(self):
+        path = filedialog.askopenfilename(
+            title="Select Target Manifest",
+            filetypes=[("Manifests", "*.csv *.jsonl *.sqlite *.db"), ("All files", "*.*")]
+        )
+        if path:
+            self.target_manifest_var.set(path)
+
+    def select_session(self):
+        path = filedialog.askopenfilename(
+            title="Select Merged Session",
+            filetypes=[("Sessions", "*.jsonl"), ("All files", "*.*")]
+        )
+        if path:
+            self.open_session(path)
+
+    def open_session(self, session_path):
+        """Show the results of a merged sharded comparison for review and execution."""
+        if self.is_comparing:
+            return
         try:
-            for root, _, files in os.walk(directory):
-                file_count += len(files)
+            header, results = self.load_session(session_path)
+        except (OSError, ValueError, KeyError) as e:
+            messagebox.showerror("Error", f"Could not read the session: {e}")
+            return
+        
+        self.origin_folder_var.set(header['origin_folder'])
+        self.target_folder_var.set(header['target_folder'])
+        self.search_different_locations_var.set(header['search_different_locations'])
+        self.filter_summary = header.get('filters', [])
+        self.stat_calls_saved = header.get('stat_calls_saved', 0)
+        self.near_duplicate_bytes = None
+        self.reset_ui()
+        self.show_results(results)
+        self.status_var.set(f"Loaded session of {header['shards']} shards ({header['files']} files). "
+                            f"Check results and select actions.")
+        self.progress_label.config(text="Session loaded")
+
+    def scan_files(self, directory, rules=None, file_stats=None):
+        """List the files of a directory that pass the filter rules (see walk_filtered for file_stats)."""
+        file_list = []
+        batch_size = 1000  # Update the UI every batch_size files
+        
+        for root, dirs, files in self.walk_filtered(directory, rules, file_stats):
+            for file in files:
+                file_list.append(os.path.join(root, file))
                 
-                # Update UI periodically during counting
-                if file_count % batch_size == 0:
-                    self.progress_label.config(text=f"Counting files: {file_count}...")
+                # Update UI periodically during scanning
+                if len(file_list) % batch_size == 0:
+                    self.progress_label.config(text=f"Scanning files: {len(file_list)}...")
                     self.update_idletasks()
-                    
-            return file_count
-        except Exception as e:
-            print(f"Error counting files: {e}")
-            return 0
+        
+        return file_list
+
+    def scan_same_layout(self, origin_folder, target_folder, rules=None, target_rules=None, file_stats=None):
+        """List the origin files and pair them with the target file at the same relative path.
+        
+        Returns the origin files, the (size, mtime_ns, None) of their target counterparts by
+        relative path, and "Target only" rows for the target files without a counterpart.
+        file_stats receives the (size, mtime_ns) of the origin files.
+        """
+        file_list = []
+        paired = {}
+        target_only = []
+        for count, (rel_path, origin_stat, target_stat) in enumerate(
+                self.merge_walk(origin_folder, target_folder, rules, target_rules), 1):
+            if origin_stat is not None:
+                path = os.path.join(origin_folder, rel_path)
+                file_list.append(path)
+                if file_stats is not None:
+                    file_stats[path] = origin_stat
+                if target_stat is not None:
+                    paired[rel_path] = target_stat + (None,)
+            else:
+                target_only.append({
+                    'origin_path': None,
+                    'target_path': os.path.join(target_folder, rel_path),
+                    'size': target_stat[0],
+                    'match_type': "Target only",
+                    'action': "Skip",
+                    'selected': False,
+                    'color': None
+                })
+            
+            # Update UI periodically during scanning
+            if count % 1000 == 0:
+                self.progress_label.config(text=f"Scanning files: {count}...")
+                self.update_idletasks()
+        
+        return file_list, paired, target_only
+
+    @staticmethod
+    def merge_walk(origin_folder, target_folder, rules=None, target_rules=None):
+        """Walk two trees in lockstep and join their files by relative path.
+        
+        Both walks (walk_filtered) list directories in sorted depth-first order, which is
+        the order of their relative paths as tuples of names, so they are merged like two
+        sorted lists in one pass, holding only the current directory of each tree.
+        Yields (relative path, origin (size, mtime_ns), target (size, mtime_ns)) in sorted
+        order, with None for the side that does not have the file.
+        """
+        def directories(top, rules):
+            file_stats = {}
+            for root, _, files in BackupCleaner.walk_filtered(top, rules, file_stats):
+                rel_root = os.path.relpath(root, top)
+                if rel_root == os.curdir:
+                    rel_root = ""
+                entries = []
+                for name in files:
+                    path = os.path.join(root, name)
+                    stat_data = file_stats.get(path)
+                    if stat_data is None:
+                        try:
+                            stat_result = os.stat(path)
+                        except OSError:
+                            continue
+                        stat_data = (stat_result.st_size, stat_result.st_mtime_ns)
+                    entries.append((name, stat_data))
+                # Stats are only needed for the current directory
+                file_stats.clear()
+                yield tuple(rel_root.split(os.sep)) if rel_root else (), rel_root, entries
+        
+        origin_dirs = directories(origin_folder, rules)
+        target_dirs = directories(target_folder, target_rules)
+        origin_dir = next(origin_dirs, None)
+        target_dir = next(target_dirs, None)
+        while origin_dir is not None or target_dir is not None:
+            if target_dir is None or (origin_dir is not None and origin_dir[0] < target_dir[0]):
+                rel_root, origin_files, target_files = origin_dir[1], origin_dir[2], []
+                origin_dir = next(origin_dirs, None)
+            elif origin_dir is None or target_dir[0] < origin_dir[0]:
+                rel_root, origin_files, target_files = target_dir[1], [], target_dir[2]
+                target_dir = next(target_dirs, None)
+            else:
+                rel_root, origin_files, target_files = origin_dir[1], origin_dir[2], target_dir[2]
+                origin_dir = next(origin_dirs, None)
+                target_dir = next(target_dirs, None)
+            
+            # Merge the sorted file lists of the directory
+            i = j = 0
+            while i < len(origin_files) or j < len(target_files):
+                if j == len(target_files) or (i < len(origin_files) and origin_files[i][0] < target_files[j][0]):
+                    name, origin_stat, target_stat = origin_files[i][0], origin_files[i][1], None
+                    i += 1
+                elif i == len(origin_files) or target_files[j][0] < origin_files[i][0]:
+                    name, origin_stat, target_stat = target_files[j][0], None, target_files[j][1]
+                    j += 1
+                else:
+                    name, origin_stat, target_stat = origin_files[i][0], origin_files[i][1], target_files[j][1]
+                    i += 1
+                    j += 1
+                yield os.path.join(rel_root, name), origin_stat, target_stat
+
+    @staticmethod
+    def walk_filtered(top, rules=None, file_stats=None):
+        """parallel_walk with the filter rules applied; excluded directories are not listed.
+        
+        file_stats is filled as by parallel_walk, and the size limits use it.
+        """
+        for root, dirs, files in BackupCleaner.parallel_walk(top, file_stats=file_stats, rules=rules):
+            if rules is not None and rules.is_active():
+                rel_root = os.path.relpath(root, top)
+                if rel_root == os.curdir:
+                    rel_root = ""
+                kept = []
+                for file in files:
+                    path = os.path.join(root, file)
+                    stat_data = file_stats.get(path) if file_stats is not None else None
+                    if rules.accept_file(path, os.path.join(rel_root, file), file,
+                                         size=stat_data[0] if stat_data else None):
+                        kept.append(file)
+                files = kept
+            yield root, dirs, files
+
+    def get_filter_rules(self):
+        """Build the filter rules from the UI. Raises ValueError for invalid input."""
+        try:
+            min_size_kb = self.min_size_var.get().strip()
+            max_size_mb = self.max_size_var.get().strip()
+            min_size = int(float(min_size_kb) * 1024) if min_size_kb else None
+            max_size = int(float(max_size_mb) * 1024 * 1024) if max_size_mb else None
+        except ValueError:
+            raise ValueError("Size limits must be numbers")
+        
+        try:
+            return FilterRules(
+                include=FilterRules.parse_patterns(self.include_var.get()),
+                exclude=FilterRules.parse_patterns(self.exclude_var.get()),
+                min_size=min_size,
+                max_size=max_size
+            )
+        except re.error as e:
+            raise ValueError(f"Invalid regular expression: {e}")
 
     def compare_folders(self):
+        if self.is_comparing:
+            return
+        
         origin_folder = self.origin_folder_var.get()
         target_folder = self.target_folder_var.get()
         
@@ -213,15 +746,52 @@ class BackupCleaner(tk.Tk):
             return
         
         # Initialize progress info
-        self.status_var.set("Counting files...")
+        self.status_var.set("Scanning files...")
         self.progress_var.set(0)
         self.progress_label.config(text="Preparing...")
         self.update_idletasks()
         
         try:
-            # Count files for progress tracking
-            self.status_var.set("Counting files...")
-            origin_files = self.count_files_in_directory(origin_folder)
+            rules = self.get_filter_rules()
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        
+        manifest = None
+        manifest_path = self.target_manifest_var.get().strip()
+        same_layout = self.same_layout_var.get()
+        if manifest_path and same_layout:
+            messagebox.showerror("Error", "Same layout mode walks the target folder and cannot use a target manifest")
+            self.status_var.set("Ready")
+            return
+        if manifest_path:
+            self.progress_label.config(text="Loading target manifest...")
+            self.update_idletasks()
+            try:
+                manifest = self.load_manifest(manifest_path)
+            except (OSError, ValueError, sqlite3.Error) as e:
+                messagebox.showerror("Error", f"Could not read the target manifest: {e}")
+                self.status_var.set("Ready")
+                return
+        
+        index_path = None
+        try:
+            # List the origin files, skipping excluded directories and files
+            self.status_var.set("Scanning files...")
+            # Sizes and times from the scan are passed on, so no later stage stats the files again
+            origin_stats = {}
+            self.stat_calls_saved = 0
+            target_only = None
+            if same_layout:
+                # One merged walk of both trees finds the pairs at the same relative path;
+                # the target metadata of the pairs is passed to the workers like a manifest
+                origin_file_list, manifest, target_only = self.scan_same_layout(
+                    origin_folder, target_folder, rules, self.get_filter_rules(), origin_stats)
+            else:
+                origin_file_list = self.scan_files(origin_folder, rules, origin_stats)
+            all_origin_files = origin_file_list
+            origin_files = len(origin_file_list)
+            self.filter_summary = rules.summary()
             
             if origin_files == 0:
                 messagebox.showinfo("Info", "No files found in the origin folder.")
@@ -230,246 +800,1073 @@ class BackupCleaner(tk.Tk):
             
             self.status_var.set(f"Processing {origin_files} files...")
             
-            # Get list of files in both directories
-            origin_file_list = []
-            for root, _, files in os.walk(origin_folder):
-                for file in files:
-                    origin_file_list.append(os.path.join(root, file))
+            # Parameters for multiprocessing
+            process_params = {
+                'origin_folder': origin_folder,
+                'target_folder': target_folder,
+                'search_different_locations': self.search_different_locations_var.get(),
+                'near_duplicates': self.near_duplicates_var.get(),
+                'same_layout': same_layout
+            }
+            
+            # Resume from the checkpoint of an interrupted run if there is one
+            checkpoint_path = self.get_checkpoint_path(process_params)
+            all_results = []
+            near_duplicate_rows = []
+            target_chunk_index = {}
+            done_files, checkpoint_results = self.load_checkpoint(checkpoint_path)
+            if done_files:
+                resume = messagebox.askyesno(
+                    "Resume Comparison",
+                    f"A checkpoint from an interrupted comparison was found "
+                    f"({len(done_files)} of {len(origin_file_list)} files already processed).\n\n"
+                    f"Resume from the checkpoint?"
+                )
+                if resume:
+                    # Only keep checkpointed files that are still present and unchanged; files
+                    # that changed since the checkpoint (or their target candidates) are compared again
+                    current_files = set(origin_file_list)
+                    valid_files = self.validate_checkpoint_results(checkpoint_results, origin_stats) & current_files
+                    all_results = [r for r in checkpoint_results if r['origin_path'] in valid_files]
+                    origin_file_list = [f for f in origin_file_list if f not in valid_files]
+                else:
+                    os.remove(checkpoint_path)
             
             # Process files in batches using multiprocessing
-            batch_size = max(1, len(origin_file_list) // (self.get_worker_count() * 2))  # Adjust batch size based on CPU count
+            batch_size = max(1, min(MAX_BATCH_SIZE, len(origin_file_list) // (self.get_worker_count() * 2)))  # Adjust batch size based on CPU count
             batches = [origin_file_list[i:i+batch_size] for i in range(0, len(origin_file_list), batch_size)]
             
             # Create a pool of workers
-            processed_files = 0
+            processed_files = origin_files - len(origin_file_list)
             
-            # Parameters for multiprocessing
-            process_params = {
-                'origin_folder': origin_folder,
-                'target_folder': target_folder,
-                'search_different_locations': self.search_different_locations_var.get()
-            }
+            # Index the target folder (or its manifest) once by normalized file name;
+            # workers load it by token
+            self.progress_label.config(text="Indexing target folder...")
+            self.update_idletasks()
+            # Origin files that share their size with another one may be duplicates of each other
+            size_counts = collections.Counter(stat[0] for stat in origin_stats.values() if stat[0])
+            duplicate_sizes = {size for size, count in size_counts.items() if count > 1}
+            
+            if same_layout:
+                # Candidates are the pairs of the merged walk, looked up by relative path
+                target_index = {}
+            else:
+                target_index, manifest = self.index_target(target_folder, self.get_filter_rules(), manifest)
+            batch_params = dict(process_params, **self.publish_target_index(target_index, manifest))
+            index_path = batch_params['index_path']
             
-            with Pool(processes=self.get_worker_count()) as pool:
+            def batch_args(batch, params):
+                return (batch, params, [origin_stats.get(path) for path in batch],
+                        [origin_stats.get(path, (0,))[0] in duplicate_sizes for path in batch])
+            
+            # Quick mode: classify every file from metadata and show it right away; only the
+            # rows that need hashing go through the pool, most reclaimable bytes first
+            quick_rows = None
+            if self.quick_mode_var.get():
+                quick_results = backup_worker.process_file_batch(batch_args(
+                    origin_file_list,
+                    dict(process_params, metadata_only=True, target_index=target_index, manifest=manifest)
+                ))
+                for result in quick_results:
+                    self.stat_calls_saved += result.pop('stat_calls_saved', 0)
+                pending = sorted(
+                    (result for result in quick_results if result.get('provisional')),
+                    key=lambda result: -result['reclaimable']
+                )
+                pending_files = {result['origin_path'] for result in pending}
+                all_results.extend(result for result in quick_results if result['origin_path'] not in pending_files)
+                quick_rows = self.show_results(
+                    [result for result in all_results if result['origin_path'] not in pending_files] +
+                    [result for result in quick_results if result['origin_path'] in pending_files]
+                )
+                origin_file_list = [result['origin_path'] for result in pending]
+                processed_files = origin_files - len(origin_file_list)
+                batches = [origin_file_list[i:i+QUICK_VERIFY_BATCH_SIZE]
+                           for i in range(0, len(origin_file_list), QUICK_VERIFY_BATCH_SIZE)]
+                self.status_var.set(f"Quick classification of {origin_files} files shown; "
+                                    f"verifying {len(origin_file_list)} by hashing...")
+            
+            self.start_compare_controls()
+            with open(self.open_checkpoint(checkpoint_path, process_params), 'a', encoding='utf-8') as checkpoint:
+                last_sync = time.monotonic()
+                pool = self.get_pool()
                 # Process batches in parallel
                 results_iter = pool.imap(
-                    self._process_file_batch, 
-                    [(batch, process_params) for batch in batches]
+                    backup_worker.process_file_batch_encoded, 
+                    [batch_args(batch, batch_params) for batch in batches]
                 )
+                # Encoded batches are only decoded into rows once all of them are in
+                encoded_batches = []
                 
-                # Process results as they come in
-                all_results = []
-                for batch_results in results_iter:
-                    all_results.extend(batch_results)
-                    processed_files += len(batch_results)
+                # Process results as they come in, keeping the UI responsive for Pause/Cancel
+                for batch in batches:
+                    batch_results = None
+                    while batch_results is None and not self.stop_background_thread:
+                        try:
+                            batch_results = results_iter.next(timeout=0.1)
+                        except multiprocessing.TimeoutError:
+                            self.update()
+                    if self.stop_background_thread:
+                        break
+                    
+                    # Chunk lists are only needed for scoring, not in the checkpoint
+                    self.stat_calls_saved += batch_results.pop('stat_calls_saved')
+                    chunks = batch_results.pop('chunks')
+                    encoded_batches.append((batch, batch_results, chunks))
+                    
+                    # Checkpoint the completed batch
+                    checkpoint.write(json.dumps({"files": batch, "encoded": backup_worker.encoded_to_json(batch_results)}) + "\n")
+                    checkpoint.flush()
+                    if time.monotonic() - last_sync >= CHECKPOINT_INTERVAL:
+                        os.fsync(checkpoint.fileno())
+                        last_sync = time.monotonic()
+                    
+                    if quick_rows is not None:
+                        self.update_result_rows(quick_rows, backup_worker.decode_results(batch_results, batch, target_folder))
+                    
+                    processed_files += len(batch)
                     progress = (processed_files / origin_files) * 100
                     self.progress_var.set(progress)
-                    self.progress_label.config(text=f"Processing files: {int(progress)}%")
+                    if quick_rows is not None:
+                        self.progress_label.config(text=f"Verifying files: {int(progress)}%")
+                    else:
+                        self.progress_label.config(text=f"Processing files: {int(progress)}%")
+                    self.update()
+                
+                if self.stop_background_thread:
+                    # The pool outlives this comparison: let the remaining batches of the
+                    # cancelled run finish (they return immediately) before it is reused
+                    self.progress_label.config(text="Cancelling...")
                     self.update_idletasks()
+                    for _ in results_iter:
+                        pass
+                os.fsync(checkpoint.fileno())
             
-            # Add all results to the UI
-            for result in all_results:
-                self.add_file_to_results(
-                    result['origin_path'],
-                    result['target_path'],
-                    result['size'],
-                    result['match_type'],
-                    result['action'],
-                    result['selected'],
-                    result['color']
-                )
+            if self.stop_background_thread and quick_rows is not None:
+                self.status_var.set(f"Verification cancelled. {origin_files - processed_files} files remain unverified "
+                                    f"(their rows cannot be executed).")
+                self.progress_label.config(text="Verification cancelled")
+                return
+            if self.stop_background_thread:
+                self.status_var.set(f"Comparison cancelled. {processed_files} of {origin_files} files checkpointed.")
+                self.progress_label.config(text="Comparison cancelled")
+                return
+            
+            # The comparison finished, so the checkpoint is no longer needed
+            os.remove(checkpoint_path)
+            
+            for batch, encoded, chunks in encoded_batches:
+                batch_results = backup_worker.decode_results(encoded, batch, target_folder)
+                for row, row_chunks in chunks:
+                    near_duplicate_rows.append((batch_results[row], row_chunks['origin']))
+                    for target_chunks in row_chunks['targets']:
+                        target_chunk_index.update(target_chunks)
+                all_results.extend(batch_results)
+            
+            # Score near-duplicates against every chunk seen in the target
+            self.near_duplicate_bytes = None
+            if near_duplicate_rows:
+                self.near_duplicate_bytes = self.score_near_duplicates(near_duplicate_rows, target_chunk_index)
+            
+            # Keep one copy of files that occur more than once in the origin
+            all_results = self.mark_origin_duplicates(all_results)
+            
+            # Report identical subtrees as a single directory row
+            if target_only is None:
+                target_rel_paths = [rel_path for paths in target_index.values() for rel_path in paths]
+            else:
+                target_rel_paths = list(manifest) + [
+                    os.path.relpath(result['target_path'], target_folder) for result in target_only]
+            all_results = self.collapse_identical_directories(
+                all_results, all_origin_files, origin_folder, target_folder, target_rel_paths
+            )
+            
+            # Same layout mode also reports the files that are only in the target
+            if target_only:
+                all_results.extend(target_only)
+            
+            # Add all results to the UI (replacing the rows of quick mode)
+            self.reset_ui()
+            self.show_results(all_results)
             
             # Update status
-            self.status_var.set(f"Processed {origin_files} files. Check results and select actions.")
+            status = f"Processed {origin_files} files. Check results and select actions."
+            if target_only is not None:
+                status += (f" Target only: {len(target_only)} files "
+                           f"({self.format_size(sum(result['size'] for result in target_only))}).")
+            if self.stat_calls_saved:
+                status += f" Stat calls saved: {self.stat_calls_saved}."
+            if self.near_duplicate_bytes is not None:
+                status += f" Near-duplicate data already in target: {self.format_size(self.near_duplicate_bytes)}."
+            if self.filter_summary:
+                status += " Skipped by filters: " + "; ".join(self.filter_summary)
+            self.status_var.set(status)
             self.progress_label.config(text="Comparison complete")
             
         except Exception as e:
+            # Do not leave tasks of the failed run in the shared pool
+            self.shutdown_pool()
             self.status_var.set("Error during comparison")
             messagebox.showerror("Error", f"An error occurred during comparison: {str(e)}")
+        finally:
+            # Workers are done with the published index (a cancelled run is drained first)
+            if index_path is not None and os.path.exists(index_path):
+                os.remove(index_path)
+            self.stop_compare_controls()
+
+    def show_results(self, results):
+        """Add result rows to the view. Returns the row indexes of each origin file."""
+        rows = collections.defaultdict(list)
+        for result in results:
+            rows[result['origin_path']].append(len(self.file_data))
+            self.add_file_to_results(
+                result['origin_path'],
+                result['target_path'],
+                result['size'],
+                result['match_type'],
+                result['action'],
+                result['selected'],
+                result['color'],
+                result.get('members'),
+                result.get('digest')
+            )
+        return rows
+
+    def update_result_rows(self, rows, results):
+        """Replace the rows shown for some origin files with their verified results.
+        
+        rows is the result of show_results. A file gets the same number of rows
+        (best match and alternatives) before and after verification.
+        """
+        by_origin = collections.defaultdict(list)
+        for result in results:
+            by_origin[result['origin_path']].append(result)
+        items = self.result_tree.get_children()
+        for origin_path, origin_results in by_origin.items():
+            indexes = rows.get(origin_path, ())
+            if len(indexes) != len(origin_results):
+                # Shown correctly when the comparison finishes
+                continue
+            for index, result in zip(indexes, origin_results):
+                self.file_data[index].update(
+                    target_path=result['target_path'],
+                    match_type=result['match_type'],
+                    action=result['action'],
+                    selected=result['selected'],
+                    digest=result.get('digest')
+                )
+                self.result_tree.item(
+                    items[index],
+                    values=(
+                        "✓" if result['selected'] else "□",
+                        result['origin_path'] if result['origin_path'] else "",
+                        result['target_path'] if result['target_path'] else "",
+                        self.format_size(result['size']),
+                        result['match_type'],
+                        result['action']
+                    ),
+                    tags=(result['color'],) if result['color'] else ()
+                )
+
+    def start_compare_controls(self):
+        """Enable the Pause/Cancel buttons and reset the shared worker events."""
+        self.is_comparing = True
+        self.is_paused = False
+        self.stop_background_thread = False
+        self.run_event.set()
+        self.cancel_event.clear()
+        self.pause_button.config(text="Pause", state=tk.NORMAL)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.compare_button.config(state=tk.DISABLED)
+        self.execute_button.config(state=tk.DISABLED)
+
+    def stop_compare_controls(self):
+        """Disable the Pause/Cancel buttons once a comparison has ended."""
+        self.is_comparing = False
+        self.is_paused = False
+        self.run_event.set()
+        self.pause_button.config(text="Pause", state=tk.DISABLED)
+        self.cancel_button.config(state=tk.DISABLED)
+        self.compare_button.config(state=tk.NORMAL)
+        self.execute_button.config(state=tk.NORMAL)
+        
+        # Close the window if that was requested while comparing
+        if self.close_requested:
+            self.after(0, self.on_close)
+
+    def toggle_pause(self):
+        """Pause or resume the running comparison."""
+        if not self.is_comparing:
+            return
+        
+        self.is_paused = not self.is_paused
+        if self.is_paused:
+            self.run_event.clear()
+            self.pause_button.config(text="Resume")
+            self.status_var.set("Comparison paused")
+        else:
+            self.run_event.set()
+            self.pause_button.config(text="Pause")
+            self.status_var.set("Comparison resumed")
+
+    def cancel_compare(self):
+        """Cancel the running comparison. Completed batches stay in the checkpoint."""
+        if not self.is_comparing:
+            return
+        
+        self.stop_background_thread = True
+        self.cancel_event.set()
+        # Wake up paused workers so they can see the cancellation
+        self.run_event.set()
+        self.status_var.set("Cancelling comparison...")
+
+    @staticmethod
+    def get_checkpoint_path(params):
+        """Return the checkpoint file used for a given origin/target/options combination."""
+        key = json.dumps([
+            os.path.abspath(params['origin_folder']),
+            os.path.abspath(params['target_folder']),
+            params['search_different_locations']
+        ] + ([True] if params.get('same_layout') else []))
+        return os.path.join(STATE_DIR, f"compare_{xxhash.xxh64(key.encode('utf-8')).hexdigest()}.jsonl")
+
+    @staticmethod
+    def open_checkpoint(checkpoint_path, params):
+        """Create the checkpoint file with its header line if it does not exist yet."""
+        if not os.path.exists(checkpoint_path):
+            os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+            with open(checkpoint_path, 'w', encoding='utf-8') as f:
+                header = dict(params, version=2, created=datetime.datetime.now().isoformat())
+                f.write(json.dumps(header) + "\n")
+        return checkpoint_path
+
+    @staticmethod
+    def load_checkpoint(checkpoint_path):
+        """Read a checkpoint file. Returns the set of processed origin files and their results."""
+        _, done_files, results, _ = BackupCleaner.read_result_file(checkpoint_path)
+        return done_files, results
+
+    @staticmethod
+    def read_result_file(path):
+        """Read a checkpoint or shard result file.
+        
+        Returns the header (None if the file is missing or unreadable), the set of
+        processed origin files, their results and the closing summary line of a
+        finished shard job (None otherwise). A file compared again after a resume
+        (because it changed) only keeps the rows of its last comparison.
+        """
+        done_files = set()
+        rows_by_origin = {}
+        footer = None
+        if not os.path.exists(path):
+            return None, done_files, [], footer
+        
+        with open(path, 'r', encoding='utf-8') as f:
+            try:
+                header = json.loads(next(f, ""))
+            except ValueError:
+                return None, done_files, [], footer
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A truncated last line means the run was interrupted mid-write
+                    break
+                if "files" not in entry:
+                    footer = entry
+                    continue
+                done_files.update(entry["files"])
+                if "encoded" in entry:
+                    batch_results = backup_worker.decode_results(entry["encoded"], entry["files"], header["target_folder"])
+                else:
+                    # Version 1 checkpoints hold the rows themselves
+                    batch_results = entry["results"]
+                batch_rows = collections.defaultdict(list)
+                for result in batch_results:
+                    batch_rows[result['origin_path']].append(result)
+                for origin_path in entry["files"]:
+                    # Superseded rows of an earlier comparison of the same file are dropped
+                    rows_by_origin.pop(origin_path, None)
+                    rows_by_origin[origin_path] = batch_rows.get(origin_path, [])
+        
+        results = [result for rows in rows_by_origin.values() for result in rows]
+        return header, done_files, results, footer
 
     @staticmethod
-    def _process_file_batch(args):
-        """Static method for parallel processing of file batches"""
-        batch, params = args
-        origin_folder = params['origin_folder']
-        target_folder = params['target_folder']
-        search_different_locations = params['search_different_locations']
+    def shard_of(rel_path, shards):
+        """Return the shard (0 to shards - 1) of an origin file, by the hash of its folder.
         
+        The folder is hashed with "/" separators, so every host assigns the same shards.
+        """
+        rel_dir = os.path.dirname(rel_path).replace(os.sep, "/")
+        return xxhash.xxh64(rel_dir.encode('utf-8')).intdigest() % shards
+
+    @staticmethod
+    def compare_shard(origin_folder, target_folder, output_path, shard=0, shards=1, rules=None,
+                      target_rules=None, manifest=None, search_different_locations=False, workers=None):
+        """Compare one shard of the origin folder without the GUI and write its result file.
+        
+        Every shard job scans the whole origin (metadata only) so that duplicate sizes are
+        known across shards, then compares the files of its shard on a pool of workers.
+        The result file has the checkpoint format and ends with a summary line once the
+        shard is complete; merge_shards combines the files of all shards.
+        Returns the number of files compared.
+        """
+        origin_stats = {}
+        shard_files = []
+        for root, _, files in BackupCleaner.walk_filtered(origin_folder, rules, origin_stats):
+            for name in files:
+                path = os.path.join(root, name)
+                if BackupCleaner.shard_of(os.path.relpath(path, origin_folder), shards) == shard:
+                    shard_files.append(path)
+        size_counts = collections.Counter(stat[0] for stat in origin_stats.values() if stat[0])
+        duplicate_sizes = {size for size, count in size_counts.items() if count > 1}
+        
+        target_index, manifest = BackupCleaner.index_target(target_folder, target_rules, manifest)
+        process_params = {
+            'origin_folder': origin_folder,
+            'target_folder': target_folder,
+            'search_different_locations': search_different_locations
+        }
+        batch_params = dict(process_params, **BackupCleaner.publish_target_index(target_index, manifest))
+        workers = workers or cpu_count()
+        batch_size = max(1, min(MAX_BATCH_SIZE, len(shard_files) // (workers * 2)))
+        batches = [shard_files[i:i+batch_size] for i in range(0, len(shard_files), batch_size)]
+        
+        stat_calls_saved = 0
+        try:
+            with open(output_path, 'w', encoding='utf-8') as f:
+                header = dict(process_params, version=2, shard=shard, shards=shards,
+                              created=datetime.datetime.now().isoformat())
+                f.write(json.dumps(header) + "\n")
+                with Pool(workers, initializer=backup_worker.init_worker, initargs=(None, None)) as pool:
+                    encoded_batches = pool.imap(backup_worker.process_file_batch_encoded, [
+                        (batch, batch_params, [origin_stats.get(path) for path in batch],
+                         [origin_stats.get(path, (0,))[0] in duplicate_sizes for path in batch])
+                        for batch in batches
+                    ])
+                    for batch, encoded in zip(batches, encoded_batches):
+                        stat_calls_saved += encoded.pop('stat_calls_saved')
+                        encoded.pop('chunks')
+                        f.write(json.dumps({"files": batch, "encoded": backup_worker.encoded_to_json(encoded)}) + "\n")
+                
+                # Shard 0 also lists the target files, for the directory comparison of the merge
+                footer = {"complete": True, "stat_calls_saved": stat_calls_saved,
+                          "filters": rules.summary() if rules is not None else []}
+                if shard == 0:
+                    footer["target_files"] = [rel_path for paths in target_index.values() for rel_path in paths]
+                f.write(json.dumps(footer) + "\n")
+        finally:
+            os.remove(batch_params['index_path'])
+        return len(shard_files)
+
+    @staticmethod
+    def validate_checkpoint_results(results, known_stats=None):
+        """Return the origin files whose checkpointed results are still valid.
+        
+        A result is valid when the origin file and every target candidate it was
+        compared with still have the size and modification time recorded when the
+        result was produced. known_stats maps paths to a current (size, mtime_ns),
+        e.g. from the scan, so those files are not stat'ed again.
+        """
+        known_stats = known_stats or {}
+        stats_by_origin = {}
+        for result in results:
+            if 'stats' in result:
+                stats_by_origin[result['origin_path']] = result['stats']
+        
+        valid_files = set()
+        for origin_path, stats in stats_by_origin.items():
+            unchanged = True
+            for path, recorded in stats.items():
+                current = known_stats.get(path)
+                if current is None:
+                    try:
+                        stat_result = os.stat(path)
+                    except OSError:
+                        unchanged = False
+                        break
+                    current = (stat_result.st_size, stat_result.st_mtime_ns)
+                if list(current) != recorded:
+                    unchanged = False
+                    break
+            if unchanged:
+                valid_files.add(origin_path)
+        return valid_files
+
+    @staticmethod
+    def merge_shards(shard_paths, session_path):
+        """Combine the result files of all shards of a comparison into one session file.
+        
+        Runs the steps that need every result: duplicates within the origin and identical
+        directories. The session file holds a header line and one row per line (see
+        load_session). Returns the number of origin files. Raises ValueError if a shard
+        is missing, unfinished or from another comparison.
+        """
+        header = None
+        shards_seen = set()
+        origin_files = set()
         results = []
+        target_rel_paths = None
+        stat_calls_saved = 0
+        for path in shard_paths:
+            shard_header, done_files, shard_results, footer = BackupCleaner.read_result_file(path)
+            if shard_header is None or 'shard' not in shard_header:
+                raise ValueError(f"{path} is not a shard result file")
+            if footer is None:
+                raise ValueError(f"Shard {shard_header['shard']} ({path}) is not finished")
+            key = ('origin_folder', 'target_folder', 'search_different_locations', 'shards')
+            if header is None:
+                header = shard_header
+            elif any(shard_header[name] != header[name] for name in key):
+                raise ValueError(f"{path} belongs to another comparison")
+            if shard_header['shard'] in shards_seen:
+                raise ValueError(f"Shard {shard_header['shard']} is given more than once")
+            shards_seen.add(shard_header['shard'])
+            origin_files.update(done_files)
+            results.extend(shard_results)
+            stat_calls_saved += footer['stat_calls_saved']
+            if shard_header['shard'] == 0:
+                target_rel_paths = footer['target_files']
+                filters = footer['filters']
+        if header is None:
+            raise ValueError("No shard result files given")
+        missing = sorted(set(range(header['shards'])) - shards_seen)
+        if missing:
+            raise ValueError(f"Missing shards: {', '.join(str(shard) for shard in missing)}")
+        
+        origin_folder, target_folder = header['origin_folder'], header['target_folder']
+        results = BackupCleaner.mark_origin_duplicates(results)
+        results = BackupCleaner.collapse_identical_directories(
+            results, sorted(origin_files), origin_folder, target_folder, target_rel_paths)
+        
+        tmp_path = session_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({
+                'session': 1,
+                'origin_folder': origin_folder,
+                'target_folder': target_folder,
+                'search_different_locations': header['search_different_locations'],
+                'shards': header['shards'],
+                'files': len(origin_files),
+                'stat_calls_saved': stat_calls_saved,
+                'filters': filters,
+                'created': datetime.datetime.now().isoformat()
+            }) + "\n")
+            for result in results:
+                # Checkpoint stats are only needed to resume a comparison
+                result.pop('stats', None)
+                f.write(json.dumps(result) + "\n")
+        os.replace(tmp_path, session_path)
+        return len(origin_files)
+
+    @staticmethod
+    def load_session(session_path):
+        """Read a session file written by merge_shards. Returns its header and result rows."""
+        with open(session_path, 'r', encoding='utf-8') as f:
+            header = json.loads(next(f, "{}"))
+            if 'session' not in header:
+                raise ValueError(f"{session_path} is not a session file")
+            return header, [json.loads(line) for line in f]
+
+    @staticmethod
+    def _list_directory(path, with_stats=False):
+        """List a directory for parallel_walk.
+        
+        Returns sorted subdirectory and file names, the symlinked subdirectories and,
+        with_stats, the (size, mtime_ns) of the files by name (free on Windows, one
+        stat per file elsewhere, made here in the listing thread).
+        """
+        dirnames = []
+        filenames = []
+        symlinks = set()
+        file_stats = {}
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        dirnames.append(entry.name)
+                        if entry.is_symlink():
+                            symlinks.add(entry.name)
+                    else:
+                        filenames.append(entry.name)
+                        if with_stats:
+                            try:
+                                stat_result = entry.stat()
+                            except OSError:
+                                # e.g. a broken symlink; later stages stat it themselves
+                                continue
+                            file_stats[entry.name] = (stat_result.st_size, stat_result.st_mtime_ns)
+        except OSError:
+            # Like os.walk, skip directories that cannot be listed
+            return None
+        dirnames.sort()
+        filenames.sort()
+        return dirnames, filenames, symlinks, file_stats
+
+    @staticmethod
+    def parallel_walk(top, topdown=True, threads=WALK_THREADS, max_in_flight=WALK_MAX_IN_FLIGHT, file_stats=None,
+                      rules=None):
+        """Drop-in replacement for os.walk that lists many directories concurrently.
+        
+        Directory listings (one round trip each on network filesystems) run in a
+        thread pool. The walking thread keeps the next directories and their
+        siblings listed ahead, and starts listing the subdirectories of every
+        finished listing, as long as fewer than max_in_flight listings wait to be
+        visited. Entries are sorted and directories are yielded in a fixed
+        depth-first order, so the output does not depend on the number of threads.
+        
+        Like os.walk, symlinked directories are reported but not descended into,
+        directories that cannot be listed are skipped, and with topdown=True the
+        caller may prune dirnames in place. With topdown=False every directory is
+        yielded after all of its subdirectories.
+        
+        If file_stats is a dict, the (size, mtime_ns) of the files of a directory are
+        added to it, keyed by path, before the directory is yielded.
+        
+        If rules (FilterRules) are given, the excluded subdirectories are removed from
+        every listing before its children are listed, so they are never scanned.
+        """
+        with_stats = file_stats is not None
+        prune = rules is not None and bool(rules.exclude)
+        # FilterRules counts what it prunes, and the listings run in several threads
+        prune_lock = threading.Lock()
+        
+        def list_directory(path):
+            listing = BackupCleaner._list_directory(path, with_stats)
+            if prune and listing is not None:
+                rel_root = os.path.relpath(path, top)
+                with prune_lock:
+                    rules.prune_dirs("" if rel_root == os.curdir else rel_root, listing[0])
+            return listing
+        
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        # Listings of directories not visited yet. Only the walking thread touches this;
+        # the done-callbacks merely report finished listings through the queue.
+        listings = {}
+        finished = queue.SimpleQueue()
+        
+        def submit(path):
+            future = executor.submit(list_directory, path)
+            listings[path] = future
+            future.add_done_callback(lambda done, path=path: finished.put(path))
+        
+        def prefetch_children():
+            # Start listing the subdirectories of finished, not yet visited directories
+            while len(listings) < max_in_flight:
+                try:
+                    path = finished.get_nowait()
+                except queue.Empty:
+                    return
+                future = listings.get(path)
+                if future is None or future.cancelled():
+                    continue
+                listing = future.result()
+                if listing is None:
+                    continue
+                dirnames, _, symlinks, _ = listing
+                for name in dirnames:
+                    if len(listings) >= max_in_flight:
+                        break
+                    child = os.path.join(path, name)
+                    if name not in symlinks and child not in listings:
+                        submit(child)
         
-        for origin_file_path in batch:
-            # Extract relative path
-            rel_path = os.path.relpath(origin_file_path, origin_folder)
-            file_size = os.path.getsize(origin_file_path)
-            filename = os.path.basename(origin_file_path)
-            
-            # Find potential matching files
-            potential_matches = []
-            
-            # Original path in target folder
-            target_path = os.path.join(target_folder, rel_path)
-            potential_matches.append(target_path)
-            
-            # Check for " - Copy" variations
-            if " - Copy" in filename:
-                # Try without " - Copy"
-                base_filename = filename.replace(" - Copy", "")
-                base_rel_path = os.path.join(os.path.dirname(rel_path), base_filename)
-                potential_matches.append(os.path.join(target_folder, base_rel_path))
-            else:
-                # Try with " - Copy"
-                copy_filename = os.path.splitext(filename)[0] + " - Copy" + os.path.splitext(filename)[1]
-                copy_rel_path = os.path.join(os.path.dirname(rel_path), copy_filename)
-                potential_matches.append(os.path.join(target_folder, copy_rel_path))
-            
-            # If searching in different locations is enabled
-            if search_different_locations:
-                # Get the parent folder name of the original file
-                parent_folder_name = os.path.basename(os.path.dirname(rel_path))
-                
-                # Search only in folders with the same parent folder name
-                for search_root, search_dirs, search_files in os.walk(target_folder):
-                    # Check if this directory has the same name as the parent folder
-                    if os.path.basename(search_root) == parent_folder_name:
-                        for file in search_files:
-                            if file == filename or (file == filename.replace(" - Copy", "")) or (file == os.path.splitext(filename)[0] + " - Copy" + os.path.splitext(filename)[1]):
-                                potential_matches.append(os.path.join(search_root, file))
-            
-            # Check for matches
-            matches = []
-            
-            for potential_match in potential_matches:
-                if os.path.exists(potential_match):
-                    # Get basic file info
-                    target_size = os.path.getsize(potential_match)
-                    
-                    # Check if exact duplicate (same content)
-                    if BackupCleaner._calculate_checksum(origin_file_path) == BackupCleaner._calculate_checksum(potential_match):
-                        matches.append({
-                            "target_path": potential_match,
-                            "match_type": "Exact match",
-                            "proposed_action": "Delete",
-                            "selected": True,
-                            "color": "green"
-                        })
-                    # Check if same name, different content
-                    elif os.path.basename(origin_file_path) == os.path.basename(potential_match):
-                        matches.append({
-                            "target_path": potential_match,
-                            "match_type": "Name match",
-                            "proposed_action": "Copy as _v2",
-                            "selected": True,
-                            "color": "orange"
-                        })
-                    # Check if same size, different content
-                    elif file_size == target_size:
-                        matches.append({
-                            "target_path": potential_match,
-                            "match_type": "Size match",
-                            "proposed_action": "Copy as _v2",
-                            "selected": True,
-                            "color": "blue"
-                        })
-            
-            # Create result entry
-            result = {}
-            
-            # If we found matches
-            if matches:
-                # Handle multiple matches
-                if len(matches) > 1:
-                    # Sort matches by priority: Exact match > Size match > Name match
-                    sorted_matches = sorted(
-                        matches,
-                        key=lambda x: (
-                            0 if x["match_type"] == "Exact match" else 
-                            1 if x["match_type"] == "Size match" else 
-                            2
-                        )
-                    )
-                    
-                    # Add the best match to results
-                    best_match = sorted_matches[0]
-                    result = {
-                        'origin_path': origin_file_path,
-                        'target_path': best_match["target_path"],
-                        'size': file_size,
-                        'match_type': f"{best_match['match_type']} (multiple matches: {len(matches)})",
-                        'action': best_match["proposed_action"],
-                        'selected': best_match["selected"],
-                        'color': best_match["color"]
-                    }
+        try:
+            # Directories still to visit, the last one is visited next. With topdown=False,
+            # a visited directory is pushed back with its listing, below its subdirectories.
+            stack = [(top, None)]
+            while stack:
+                prefetch_children()
+                root, visited = stack.pop()
+                if visited is not None:
+                    yield visited
+                    continue
+                
+                # The next directory must be listed; also start its upcoming siblings
+                if root not in listings:
+                    submit(root)
+                for path, pending in stack[-threads:]:
+                    if pending is None and path not in listings and len(listings) < max_in_flight:
+                        submit(path)
+                
+                listing = listings.pop(root).result()
+                if listing is None:
+                    continue
+                dirnames, filenames, symlinks, stats = listing
+                for name, stat_data in stats.items():
+                    file_stats[os.path.join(root, name)] = stat_data
+                
+                if topdown:
+                    all_dirnames = list(dirnames)
+                    yield root, dirnames, filenames
                     
-                    # Add other matches with different proposed action
-                    for i, match in enumerate(sorted_matches[1:]):
-                        results.append({
-                            'origin_path': origin_file_path,
-                            'target_path': match["target_path"],
-                            'size': file_size,
-                            'match_type': f"Alternative match #{i+1}",
-                            'action': "Skip",  # We skip alternative matches by default
-                            'selected': False,
-                            'color': None
-                        })
+                    # Forget prefetched listings below directories the caller pruned
+                    pruned = [os.path.join(root, name) for name in all_dirnames if name not in dirnames]
+                    if pruned:
+                        for path in [path for path in listings if any(
+                                path == prefix or path.startswith(prefix + os.sep) for prefix in pruned)]:
+                            listings.pop(path).cancel()
                 else:
-                    # Single match
-                    match = matches[0]
-                    result = {
-                        'origin_path': origin_file_path,
-                        'target_path': match["target_path"],
-                        'size': file_size,
-                        'match_type': match["match_type"],
-                        'action': match["proposed_action"],
-                        'selected': match["selected"],
-                        'color': match["color"]
-                    }
+                    stack.append((root, (root, dirnames, filenames)))
+                
+                # Visit subdirectories in sorted order (pushed in reverse onto the stack)
+                for name in reversed(dirnames):
+                    if name not in symlinks:
+                        stack.append((os.path.join(root, name), None))
+        finally:
+            for future in listings.values():
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    @staticmethod
+    def build_target_index(target_folder, rules=None, manifest=None, file_stats=None):
+        """Map normalized file names to the paths (relative to target_folder) that have them.
+        
+        With a manifest (see load_manifest) the target folder is not scanned; otherwise
+        file_stats is filled as by parallel_walk.
+        """
+        index = collections.defaultdict(list)
+        if manifest is None:
+            walk = BackupCleaner.walk_filtered(target_folder, rules, file_stats)
+        else:
+            walk = BackupCleaner.walk_manifest(target_folder, manifest, rules)
+        for root, _, files in walk:
+            rel_root = os.path.relpath(root, target_folder)
+            if rel_root == os.curdir:
+                rel_root = ""
+            for file in files:
+                index[backup_worker.normalize_name(file)].append(os.path.join(rel_root, file))
+        return dict(index)
+
+    @staticmethod
+    def index_target(target_folder, rules=None, manifest=None):
+        """Index the target folder (or its manifest) and return the index and the workers' manifest.
+        
+        The returned manifest holds the (size, mtime_ns, digest) of the indexed files only;
+        without a manifest file, it is built from the scan (without digests).
+        """
+        if manifest is not None:
+            target_index = BackupCleaner.build_target_index(target_folder, rules, manifest)
+            # Workers only need the entries that passed the filters
+            return target_index, {rel_path: manifest[rel_path] for paths in target_index.values() for rel_path in paths}
+        
+        target_stats = {}
+        target_index = BackupCleaner.build_target_index(target_folder, rules, None, target_stats)
+        manifest = {}
+        for paths in target_index.values():
+            for rel_path in paths:
+                stat_data = target_stats.get(os.path.join(target_folder, rel_path))
+                if stat_data is not None:
+                    manifest[rel_path] = stat_data + (None,)
+        return target_index, manifest
+
+    @staticmethod
+    def walk_manifest(top, manifest, rules=None):
+        """Walk the tree described by a manifest like walk_filtered walks a folder."""
+        subdirs = collections.defaultdict(set)
+        files = collections.defaultdict(list)
+        for rel_path in manifest:
+            rel_dir, name = os.path.split(rel_path)
+            files[rel_dir].append(name)
+            # Register any ancestors not seen yet
+            while rel_dir and rel_dir not in subdirs[os.path.dirname(rel_dir)]:
+                subdirs[os.path.dirname(rel_dir)].add(os.path.basename(rel_dir))
+                rel_dir = os.path.dirname(rel_dir)
+        
+        stack = [""]
+        while stack:
+            rel_root = stack.pop()
+            root = os.path.join(top, rel_root) if rel_root else top
+            dirs = sorted(subdirs.get(rel_root, ()))
+            names = sorted(files.get(rel_root, ()))
+            if rules is not None and rules.is_active():
+                rules.prune_dirs(rel_root, dirs)
+                names = [
+                    name for name in names
+                    if rules.accept_file(os.path.join(root, name), os.path.join(rel_root, name), name,
+                                         size=manifest[os.path.join(rel_root, name)][0])
+                ]
+            yield root, dirs, names
+            stack.extend(os.path.join(rel_root, name) for name in reversed(dirs))
+
+    @staticmethod
+    def load_manifest(manifest_path):
+        """Load a target manifest: {relative path: (size, mtime_ns, digest or None)}.
+        
+        Manifests list the files of a target folder with the fields path (relative to the
+        folder, "/" separated), size (bytes), mtime_ns and digest ("xxh64tree:<hex>", may be
+        empty). They are CSV files with a header row, JSONL files with one object per
+        line, or SQLite databases with a "files" table. Digests of another type are
+        ignored, so those files are read when needed. Raises ValueError for bad rows.
+        """
+        ext = os.path.splitext(manifest_path)[1].lower()
+        if ext not in (".csv", ".jsonl", ".sqlite", ".db"):
+            raise ValueError(f"Unknown manifest format '{ext}' (use .csv, .jsonl or .sqlite)")
+        
+        prefix = MANIFEST_DIGEST_TYPE + ":"
+        manifest = {}
+        try:
+            if ext == ".csv":
+                with open(manifest_path, 'r', encoding='utf-8', newline='') as f:
+                    rows = [(row["path"], row["size"], row.get("mtime_ns"), row.get("digest")) for row in csv.DictReader(f)]
+            elif ext == ".jsonl":
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    rows = [
+                        (row["path"], row["size"], row.get("mtime_ns"), row.get("digest"))
+                        for row in map(json.loads, filter(str.strip, f))
+                    ]
             else:
-                # No matches found
-                result = {
-                    'origin_path': origin_file_path,
-                    'target_path': None,
-                    'size': file_size,
-                    'match_type': "No match",
-                    'action': "Move",
-                    'selected': False,
-                    'color': None
-                }
+                db = sqlite3.connect(f"file:{manifest_path}?mode=ro", uri=True)
+                try:
+                    rows = db.execute("SELECT path, size, mtime_ns, digest FROM files").fetchall()
+                finally:
+                    db.close()
             
-            results.append(result)
-        
-        return results
-    
+            for path, size, mtime_ns, digest in rows:
+                digest = digest[len(prefix):] if digest and digest.startswith(prefix) else None
+                manifest[os.path.normpath(path)] = (int(size), int(mtime_ns or 0), digest)
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"Invalid manifest row: {e!r}")
+        return manifest
+
     @staticmethod
-    def _calculate_checksum(file_path):
-        """Calculate xxHash (xxh64) checksum for a file with optimizations for large files."""
-        file_size = os.path.getsize(file_path)
-        hasher = xxhash.xxh64()
-        
-        with open(file_path, "rb") as f:
-            if file_size > 100 * 1024 * 1024:  # For files larger than 100MB
-                # Hash the first 1MB
-                hasher.update(f.read(1024 * 1024))
-                
-                # Move to the middle and hash 1MB
-                f.seek(file_size // 2, 0)
-                hasher.update(f.read(1024 * 1024))
-                
-                # Move to the end and hash the last 1MB
-                f.seek(-1024 * 1024, 2)
-                hasher.update(f.read(1024 * 1024))
+    def write_manifest(folder, manifest_path, with_digests=True, workers=None):
+        """Write the manifest of a folder (format chosen by extension, see load_manifest).
+        
+        Returns the number of files listed.
+        """
+        ext = os.path.splitext(manifest_path)[1].lower()
+        if ext not in (".csv", ".jsonl", ".sqlite", ".db"):
+            raise ValueError(f"Unknown manifest format '{ext}' (use .csv, .jsonl or .sqlite)")
+        
+        file_stats = {}
+        files = [
+            (os.path.join(root, name), os.path.relpath(os.path.join(root, name), folder), with_digests)
+            for root, _, names in BackupCleaner.parallel_walk(folder, file_stats=file_stats)
+            for name in names
+        ]
+        files = [args + (file_stats.get(args[0]),) for args in files]
+        # Write to a temporary file, so a failed run never leaves a truncated manifest behind
+        tmp_path = manifest_path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        with Pool(workers or cpu_count()) as pool:
+            rows = pool.imap(backup_worker.manifest_row, files, chunksize=64)
+            if ext in (".sqlite", ".db"):
+                with sqlite3.connect(tmp_path) as db:
+                    db.execute("CREATE TABLE files (path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                               "mtime_ns INTEGER, digest TEXT)")
+                    db.executemany("INSERT INTO files VALUES (?, ?, ?, ?)", rows)
+                db.close()
             else:
-                # For smaller files, read in 1MB chunks
-                for byte_block in iter(lambda: f.read(1024 * 1024), b""):
-                    hasher.update(byte_block)
-                    
-        return hasher.hexdigest()
+                with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+                    if ext == ".csv":
+                        writer = csv.writer(f)
+                        writer.writerow(["path", "size", "mtime_ns", "digest"])
+                        writer.writerows(rows)
+                    else:
+                        for path, size, mtime_ns, digest in rows:
+                            f.write(json.dumps({"path": path, "size": size, "mtime_ns": mtime_ns, "digest": digest}) + "\n")
+        os.replace(tmp_path, manifest_path)
+        return len(files)
+
+    @staticmethod
+    def build_merkle_digests(file_digests):
+        """Build Merkle digests for every directory of a tree.
+        
+        file_digests maps file paths (relative to the tree root) to their content
+        digest, or None when it is unknown. A directory digest covers the names and
+        digests of its files and subdirectories, so two directories have the same
+        digest only if their whole subtrees are identical. Directories containing a
+        file with an unknown digest get None. The root directory is "".
+        """
+        children = collections.defaultdict(list)
+        dirs = {""}
+        for rel_path in file_digests:
+            rel_dir = os.path.dirname(rel_path)
+            children[rel_dir].append(("F", os.path.basename(rel_path), rel_path))
+            # Register any ancestors not seen yet
+            while rel_dir not in dirs:
+                dirs.add(rel_dir)
+                parent = os.path.dirname(rel_dir)
+                children[parent].append(("D", os.path.basename(rel_dir), rel_dir))
+                rel_dir = parent
+        
+        dir_digests = {}
+        # Deepest directories first so child digests are ready for their parents
+        for rel_dir in sorted(dirs, key=lambda d: d.count(os.sep) + (1 if d else 0), reverse=True):
+            parts = []
+            for kind, name, rel_path in sorted(children[rel_dir]):
+                digest = file_digests[rel_path] if kind == "F" else dir_digests[rel_path]
+                if digest is None:
+                    parts = None
+                    break
+                parts.append(f"{kind}:{name}:{digest}")
+            dir_digests[rel_dir] = None if parts is None else xxhash.xxh64("\0".join(parts).encode("utf-8")).hexdigest()
+        
+        return dir_digests
+
+    @staticmethod
+    def mark_origin_duplicates(results):
+        """Classify redundant copies of the same content within the origin as duplicates.
+        
+        Files are grouped by size and digest. If a copy is an exact match in the target,
+        every other copy is redundant; otherwise the first copy (by path) keeps its action.
+        The others get a "Delete" action whose target is the copy that is kept, which must
+        still exist (at its origin or its destination) when they are deleted.
+        """
+        groups = collections.defaultdict(list)
+        for result in results:
+            if result.get('digest') and result['size'] and 'members' not in result:
+                groups[(result['size'], result['digest'])].append(result)
+        
+        for rows in groups.values():
+            if len(rows) < 2:
+                continue
+            rows.sort(key=lambda result: result['origin_path'])
+            kept = [result for result in rows if result['match_type'].startswith("Exact match")]
+            if kept:
+                keep_path = kept[0]['target_path']
+            else:
+                kept = rows[:1]
+                keep_path = kept[0]['origin_path']
+            for result in rows:
+                if any(result is other for other in kept):
+                    continue
+                result.update({
+                    'target_path': keep_path,
+                    'match_type': f"Duplicate within origin ({len(rows)} copies)",
+                    'action': "Delete",
+                    'selected': True,
+                    'color': "purple"
+                })
+        return results
+
+    @staticmethod
+    def collapse_identical_directories(results, origin_files, origin_folder, target_folder, target_rel_paths):
+        """Replace the rows of identical subtrees with one directory-level row.
+        
+        A directory is identical when its Merkle digest matches the one of the
+        directory with the same relative path in the target. Origin file digests
+        count only for exact matches at the same relative path; target file digests
+        are known from those matches, so target-only files make a directory differ.
+        """
+        # Origin digests: only files that are an exact match at the same relative path
+        exact_rows = {}
+        origin_digests = {os.path.relpath(path, origin_folder): None for path in origin_files}
+        target_digests = {rel_path: None for rel_path in target_rel_paths}
+        for result in results:
+            if not result['match_type'].startswith("Exact match") or not result.get('digest'):
+                continue
+            rel_path = os.path.relpath(result['origin_path'], origin_folder)
+            if result['target_path'] != os.path.join(target_folder, rel_path):
+                continue
+            exact_rows[rel_path] = result
+            origin_digests[rel_path] = result['digest']
+            target_digests[rel_path] = result['digest']
+        
+        origin_dir_digests = BackupCleaner.build_merkle_digests(origin_digests)
+        target_dir_digests = BackupCleaner.build_merkle_digests(target_digests)
+        identical_dirs = {
+            rel_dir for rel_dir, digest in origin_dir_digests.items()
+            if digest is not None and target_dir_digests.get(rel_dir) == digest
+        }
+        if not identical_dirs:
+            return results
+        
+        # Only collapse the topmost identical directories
+        top_dirs = {
+            rel_dir for rel_dir in identical_dirs
+            if rel_dir == "" or os.path.dirname(rel_dir) not in identical_dirs
+        }
+        
+        def top_dir_of(rel_path):
+            rel_dir = os.path.dirname(rel_path)
+            while True:
+                if rel_dir in top_dirs:
+                    return rel_dir
+                if not rel_dir:
+                    return None
+                rel_dir = os.path.dirname(rel_dir)
+        
+        members = collections.defaultdict(list)
+        for rel_path in exact_rows:
+            top_dir = top_dir_of(rel_path)
+            if top_dir is not None:
+                members[top_dir].append(rel_path)
+        
+        collapsed_files = set()
+        dir_rows = []
+        for rel_dir in sorted(members):
+            rel_paths = sorted(members[rel_dir])
+            if len(rel_paths) < 2:
+                # A single file is already one row
+                continue
+            member_paths = [os.path.join(origin_folder, rel_path) for rel_path in rel_paths]
+            collapsed_files.update(member_paths)
+            member_sizes = [exact_rows[rel_path]['size'] for rel_path in rel_paths]
+            dir_rows.append({
+                'origin_path': os.path.join(origin_folder, rel_dir) if rel_dir else origin_folder,
+                'target_path': os.path.join(target_folder, rel_dir) if rel_dir else target_folder,
+                'size': sum(member_sizes),
+                'match_type': f"Exact match (directory, {len(rel_paths)} files)",
+                'action': "Delete directory",
+                'selected': True,
+                'color': "green",
+                'digest': origin_dir_digests[rel_dir],
+                'members': [list(member) for member in zip(member_paths, member_sizes)]
+            })
+        
+        return dir_rows + [result for result in results if result['origin_path'] not in collapsed_files]
+
+    @staticmethod
+    def publish_target_index(target_index, manifest=None):
+        """Save the target index (and manifest) for the pool workers and return the params pointing to it.
+        
+        Every comparison gets its own file (its name is the token), so another
+        instance or a later comparison never replaces an index workers still load.
+        The caller deletes the file when the comparison ends.
+        """
+        os.makedirs(STATE_DIR, exist_ok=True)
+        fd, index_path = tempfile.mkstemp(prefix="target_index_", suffix=".pickle", dir=STATE_DIR)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((target_index, manifest), f, protocol=pickle.HIGHEST_PROTOCOL)
+        return {'index_path': index_path, 'index_token': os.path.basename(index_path)}
+
+    @staticmethod
+    def score_near_duplicates(rows, target_chunks):
+        """Add the share of each row's origin data already stored in the target.
+
+        rows is a list of (result, origin chunk list); target_chunks maps the chunk
+        digests of the analyzed target files to their length. Sets 'similarity' (percent)
+        on each result, appends it to the match type and returns the redundant bytes.
+        """
+        redundant = 0
+        for result, chunks in rows:
+            if not result['size']:
+                continue
+            shared = sum(length for digest, length in chunks if digest in target_chunks)
+            similarity = shared * 100 // result['size']
+            result['similarity'] = similarity
+            result['match_type'] += f" ({similarity}% similar)"
+            redundant += shared
+        return redundant
 
     def calculate_checksum(self, file_path):
         """Instance method that calls the static method for compatibility"""
-        return self._calculate_checksum(file_path)
+        return backup_worker.calculate_checksum(file_path)
 
-    def add_file_to_results(self, origin_path, target_path, size, match_type, action, selected=False, color=None):
-        """Add a file comparison result to the treeview."""
+    def add_file_to_results(self, origin_path, target_path, size, match_type, action, selected=False, color=None, members=None, digest=None):
+        """Add a file comparison result to the treeview.
+        
+        members lists the [origin path, size] pairs covered by a directory-level row;
+        digest is the origin file's digest from the comparison, used to verify copies.
+        """
         # Store file data
         file_id = len(self.file_data)
         self.file_data.append({
@@ -479,7 +1876,9 @@ class BackupCleaner(tk.Tk):
             "size": size,
             "match_type": match_type,
             "action": action,
-            "selected": selected
+            "selected": selected,
+            "members": members,
+            "digest": digest
         })
         
         # Format the size
@@ -490,7 +1889,7 @@ class BackupCleaner(tk.Tk):
             "", tk.END,
             values=(
                 "✓" if selected else "□", 
-                origin_path, 
+                origin_path if origin_path else "", 
                 target_path if target_path else "", 
                 size_formatted, 
                 match_type, 
@@ -502,7 +1901,17 @@ class BackupCleaner(tk.Tk):
         if color:
             self.result_tree.item(item, tags=(color,))
 
-    def format_size(self, size_bytes):
+    @staticmethod
+    def format_duration(seconds):
+        """Format a duration in a human-readable format."""
+        if seconds < 60:
+            return f"{int(seconds)} s"
+        if seconds < 3600:
+            return f"{int(seconds // 60)} min {int(seconds % 60)} s"
+        return f"{int(seconds // 3600)} h {int(seconds % 3600 // 60)} min"
+
+    @staticmethod
+    def format_size(size_bytes):
         """Format file size in a human-readable format."""
         for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
             if size_bytes < 1024.0:
@@ -534,7 +1943,7 @@ class BackupCleaner(tk.Tk):
                 item, 
                 values=(
                     "✓" if file_data["selected"] else "□", 
-                    file_data["origin_path"], 
+                    file_data["origin_path"] if file_data["origin_path"] else "", 
                     file_data["target_path"] if file_data["target_path"] else "", 
                     self.format_size(file_data["size"]), 
                     file_data["match_type"], 
@@ -564,6 +1973,8 @@ class BackupCleaner(tk.Tk):
         move_count = 0
         delete_count = 0
         copy_count = 0
+        dir_delete_count = 0
+        dir_file_count = 0
         
         selected_files = []
         for file_data in self.file_data:
@@ -575,11 +1986,21 @@ class BackupCleaner(tk.Tk):
                     delete_count += 1
                 elif file_data["action"] == "Copy as _v2" or file_data["action"] == "Manual check needed":
                     copy_count += 1
+                elif file_data["action"] == "Delete directory":
+                    dir_delete_count += 1
+                    dir_file_count += len(file_data["members"])
         
-        if move_count == 0 and delete_count == 0 and copy_count == 0:
+        if move_count == 0 and delete_count == 0 and copy_count == 0 and dir_delete_count == 0:
             messagebox.showinfo("Info", "No actions selected.")
             return
         
+        origin_folder = self.origin_folder_var.get()
+        target_folder = self.target_folder_var.get()
+        
+        # Plan the operations and estimate their I/O cost
+        plan = self.plan_actions(selected_files, origin_folder, target_folder)
+        estimate = self.analyze_plan(plan, self.load_throughput_history())
+        
         # Confirm action
         message = f"About to perform the following actions:\n"
         if move_count > 0:
@@ -588,6 +2009,9 @@ class BackupCleaner(tk.Tk):
             message += f"- Delete {delete_count} files\n"
         if copy_count > 0:
             message += f"- Copy {copy_count} files with _v2 suffix\n"
+        if dir_delete_count > 0:
+            message += f"- Delete {dir_delete_count} identical directories ({dir_file_count} files)\n"
+        message += "\n" + self.format_plan_estimate(estimate)
         message += "\nDo you want to continue?"
         
         # Check for files that need manual verification
@@ -600,16 +2024,114 @@ class BackupCleaner(tk.Tk):
         if manual_check_needed:
             message += "\n\nWARNING: Some selected files are large (>500MB) and require manual verification."
         
+        if estimate["warnings"]:
+            message += "\n\nWARNING:\n" + "\n".join(f"- {warning}" for warning in estimate["warnings"])
+        
         if not messagebox.askyesno("Confirm Actions", message):
             return
         
-        # Execute actions
+        # Write the whole plan to the journal before touching any file
+        journal = ActionJournal.create(JOURNAL_PATH, origin_folder, target_folder, plan)
+        
+        success_count, error_count = self.run_journaled_plan(journal, plan)
+        
+        # Clean up empty directories in origin folder
+        self.cleanup_empty_directories(origin_folder)
+        
+        # Update status and show message
+        self.status_var.set(f"Actions completed. Success: {success_count}, Errors: {error_count}")
+        self.progress_label.config(text="Actions completed")
+        messagebox.showinfo("Actions Completed", f"Actions completed.\nSuccess: {success_count}\nErrors: {error_count}")
+        
+        # Refresh the file list
+        self.compare_folders()
+
+    @staticmethod
+    def plan_actions(selected_files, origin_folder, target_folder):
+        """Turn the selected rows into a list of file operations, one per origin file."""
+        plan = []
+        # Keep track of planned origin files to handle multiple matches
+        planned_origin_files = set()
+        planned_dest_paths = set()
+        
+        for file_data in selected_files:
+            action = file_data["action"]
+            if action == "Delete directory":
+                # Identical directories are deleted file by file; empty folders are cleaned up afterwards
+                for member_path, member_size in file_data["members"]:
+                    if member_path not in planned_origin_files:
+                        planned_origin_files.add(member_path)
+                        plan.append({
+                            "seq": len(plan),
+                            "action": "Delete",
+                            "origin_path": member_path,
+                            "dest_path": None,
+                            "size": member_size,
+                            "keep_paths": [os.path.join(
+                                file_data["target_path"], os.path.relpath(member_path, file_data["origin_path"]))]
+                        })
+                continue
+            if action not in ("Move", "Delete", "Copy as _v2", "Manual check needed"):
+                continue
+            if file_data["origin_path"] in planned_origin_files:
+                continue
+            planned_origin_files.add(file_data["origin_path"])
+            
+            rel_path = os.path.relpath(file_data["origin_path"], origin_folder)
+            if action == "Move":
+                dest_path = os.path.join(target_folder, rel_path)
+            elif action == "Delete":
+                dest_path = None
+            else:
+                # Use the first free _vN name, so earlier versions (including _v2 files from
+                # previous runs and copies planned in this run) are never overwritten
+                file_name, file_ext = os.path.splitext(os.path.basename(rel_path))
+                version = 2
+                while True:
+                    new_rel_path = os.path.join(os.path.dirname(rel_path), f"{file_name}_v{version}{file_ext}")
+                    dest_path = os.path.join(target_folder, new_rel_path)
+                    if dest_path not in planned_dest_paths and not os.path.exists(dest_path):
+                        break
+                    version += 1
+                planned_dest_paths.add(dest_path)
+            
+            plan.append({
+                "seq": len(plan),
+                "action": action,
+                "origin_path": file_data["origin_path"],
+                "dest_path": dest_path,
+                "size": file_data["size"]
+            })
+            if action == "Delete":
+                plan[-1]["keep_paths"] = [file_data["target_path"]]
+            elif action != "Move" and file_data.get("digest"):
+                plan[-1]["digest"] = file_data["digest"]
+        
+        # A duplicate within the origin may be deleted once the kept copy exists at its
+        # origin path or at the destination it is moved or copied to
+        dest_by_origin = {entry["origin_path"]: entry["dest_path"] for entry in plan if entry["dest_path"]}
+        for entry in plan:
+            keep_paths = entry.get("keep_paths")
+            if keep_paths and keep_paths[0] in dest_by_origin:
+                keep_paths.append(dest_by_origin[keep_paths[0]])
+        
+        # Execute the operations directory by directory, for locality on metadata-heavy
+        # filesystems; every destination directory is then only created once
+        plan.sort(key=BackupCleaner.plan_group_key)
+        for seq, entry in enumerate(plan):
+            entry["seq"] = seq
+        return plan
+
+    @staticmethod
+    def plan_group_key(entry):
+        """The directory an operation writes to: its destination, or the origin for deletes."""
+        return os.path.dirname(entry["dest_path"] or entry["origin_path"])
+
+    def run_journaled_plan(self, journal, plan):
+        """Execute the planned operations, recording each completed one in the journal."""
         error_count = 0
         success_count = 0
-        origin_folder = self.origin_folder_var.get()
-        target_folder = self.target_folder_var.get()
-        
-        total_files = len(selected_files)
+        total_files = max(1, len(plan))
         processed_files = 0
         
         # Reset progress bar
@@ -618,74 +2140,399 @@ class BackupCleaner(tk.Tk):
         self.status_var.set("Executing actions...")
         self.update_idletasks()
         
-        # Keep track of processed origin files to handle multiple matches
-        processed_origin_files = set()
+        # Measured throughput of this run, per device pair and for metadata-only operations
+        run_stats = collections.defaultdict(lambda: {"bytes": 0, "ops": 0, "seconds": 0.0})
+        throttled = False
         
-        for file_data in selected_files:
-            if file_data["origin_path"] not in processed_origin_files:
-                try:
-                    if file_data["action"] == "Move":
-                        # Create target directory structure if needed
-                        rel_path = os.path.relpath(file_data["origin_path"], origin_folder)
-                        target_path = os.path.join(target_folder, rel_path)
-                        target_dir = os.path.dirname(target_path)
-                        
-                        # Create target directory if it doesn't exist
-                        os.makedirs(target_dir, exist_ok=True)
-                        
-                        # Move the file
-                        shutil.move(file_data["origin_path"], target_path)
-                        processed_origin_files.add(file_data["origin_path"])
-                        success_count += 1
-                    
-                    elif file_data["action"] == "Delete":
-                        # Delete the file
-                        os.remove(file_data["origin_path"])
-                        processed_origin_files.add(file_data["origin_path"])
+        # Destination directories known to exist, so each one is created only once
+        known_dirs = set()
+        
+        try:
+            # The plan is ordered by directory (see plan_actions); run it one directory at a time
+            for _, group in itertools.groupby(plan, key=self.plan_group_key):
+                for entry in group:
+                    if entry["seq"] in journal.done:
+                        # Already executed before an interruption
                         success_count += 1
+                    else:
+                        try:
+                            started = time.monotonic()
+                            # Throttled operations measure the limit, not the disk
+                            throttled |= self.io_throttle.is_limited()
+                            self._perform_action(entry, self.io_throttle, known_dirs)
+                            stats = run_stats[entry["device_pair"] if entry.get("mode") == "copy" else "metadata"]
+                            stats["bytes"] += entry.get("size") or 0
+                            stats["ops"] += 1
+                            stats["seconds"] += time.monotonic() - started
+                            journal.record(entry["seq"], "done")
+                            success_count += 1
+                        except Exception as e:
+                            error_count += 1
+                            journal.record(entry["seq"], "failed", error=str(e))
+                            print(f"Error processing {entry['origin_path']}: {e}")
                     
-                    elif file_data["action"] == "Copy as _v2" or file_data["action"] == "Manual check needed":
-                        # Create target directory structure if needed
-                        rel_path = os.path.relpath(file_data["origin_path"], origin_folder)
-                        file_name, file_ext = os.path.splitext(os.path.basename(rel_path))
-                        new_file_name = f"{file_name}_v2{file_ext}"
-                        new_rel_path = os.path.join(os.path.dirname(rel_path), new_file_name)
-                        target_path = os.path.join(target_folder, new_rel_path)
-                        target_dir = os.path.dirname(target_path)
-                        
-                        # Create target directory if it doesn't exist
-                        os.makedirs(target_dir, exist_ok=True)
-                        
-                        # Copy the file with _v2 suffix
-                        shutil.copy2(file_data["origin_path"], target_path)
-                        
-                        # Delete the original file after copying
-                        os.remove(file_data["origin_path"])
-                        
-                        processed_origin_files.add(file_data["origin_path"])
-                        success_count += 1
+                    processed_files += 1
+                    if processed_files % JOURNAL_SYNC_EVERY == 0:
+                        self.show_execute_progress(processed_files, total_files)
+                
+                # Update progress once per directory (and every JOURNAL_SYNC_EVERY operations)
+                self.show_execute_progress(processed_files, total_files)
+        finally:
+            journal.close()
+            if not throttled:
+                self.save_throughput_history(run_stats)
+        
+        # Every entry has been attempted, so the plan no longer needs to be recovered
+        journal.remove()
+        return success_count, error_count
+
+    def show_execute_progress(self, processed_files, total_files):
+        progress_percentage = (processed_files / total_files) * 100
+        self.progress_var.set(progress_percentage)
+        self.progress_label.config(text=f"Executing actions: {int(progress_percentage)}%")
+        self.update_idletasks()
+
+    @staticmethod
+    def _device_of(path, cache):
+        """Return the device id of path's nearest existing ancestor directory (cached per directory)."""
+        directory = os.path.dirname(path)
+        if directory in cache:
+            return cache[directory]
+        probe = directory
+        while True:
+            try:
+                device = os.stat(probe).st_dev
+                break
+            except OSError:
+                parent = os.path.dirname(probe)
+                if parent == probe:
+                    device = None
+                    break
+                probe = parent
+        cache[directory] = device
+        return device
+
+    @staticmethod
+    def analyze_plan(plan, history):
+        """Estimate the I/O cost of an action plan.
+        
+        Each entry is annotated with its "mode": "rename" for moves on one device,
+        "copy" for _v2 copies and moves across devices, "delete" otherwise, plus the
+        "device_pair" it copies between. Bytes are summed per action and per device
+        pair, and the duration is predicted from the throughput measured in recent
+        runs (see load_throughput_history).
+        """
+        device_cache = {}
+        bytes_per_action = collections.Counter()
+        pairs = {}
+        metadata_ops = 0
+        free_space = {}
+        
+        for entry in plan:
+            size = entry.get("size") or 0
+            bytes_per_action[entry["action"]] += size
+            if entry["dest_path"] is None:
+                entry["mode"] = "delete"
+                metadata_ops += 1
+                continue
+            
+            src_device = BackupCleaner._device_of(entry["origin_path"], device_cache)
+            dst_device = BackupCleaner._device_of(entry["dest_path"], device_cache)
+            entry["device_pair"] = f"{src_device}->{dst_device}"
+            if entry["action"] == "Move" and src_device is not None and src_device == dst_device:
+                entry["mode"] = "rename"
+                metadata_ops += 1
+                continue
+            
+            entry["mode"] = "copy"
+            pair = pairs.setdefault(entry["device_pair"], {"bytes": 0, "files": 0, "dest": entry["dest_path"]})
+            pair["bytes"] += size
+            pair["files"] += 1
+        
+        warnings = []
+        seconds = metadata_ops / history.get("metadata_ops_per_second", DEFAULT_METADATA_OPS_PER_SECOND)
+        for device_pair, pair in pairs.items():
+            measured = history.get("pairs", {}).get(device_pair)
+            throughput = measured or DEFAULT_COPY_BYTES_PER_SECOND
+            pair["throughput"] = throughput
+            pair["measured"] = measured is not None
+            pair["seconds"] = pair["bytes"] / throughput
+            seconds += pair["seconds"]
+            
+            if pair["seconds"] > SLOW_PLAN_SECONDS and throughput < SLOW_DISK_BYTES_PER_SECOND:
+                warnings.append(
+                    f"Copying {BackupCleaner.format_size(pair['bytes'])} over {device_pair} at "
+                    f"{BackupCleaner.format_size(throughput)}/s will keep a slow disk busy for "
+                    f"about {BackupCleaner.format_duration(pair['seconds'])}"
+                )
+            
+            # Check the free space of each destination device once
+            if device_pair not in free_space:
+                try:
+                    probe = os.path.dirname(pair["dest"])
+                    while not os.path.exists(probe):
+                        probe = os.path.dirname(probe)
+                    free_space[device_pair] = shutil.disk_usage(probe).free
+                except OSError:
+                    free_space[device_pair] = None
+            if free_space[device_pair] is not None and pair["bytes"] > free_space[device_pair]:
+                warnings.append(
+                    f"{BackupCleaner.format_size(pair['bytes'])} to copy over {device_pair}, but only "
+                    f"{BackupCleaner.format_size(free_space[device_pair])} free on the destination"
+                )
+        
+        return {
+            "bytes_per_action": dict(bytes_per_action),
+            "pairs": pairs,
+            "metadata_ops": metadata_ops,
+            "seconds": seconds,
+            "warnings": warnings
+        }
+
+    def format_plan_estimate(self, estimate):
+        """Describe a plan estimate for the confirmation dialog."""
+        lines = ["Estimated I/O:"]
+        for action, size in sorted(estimate["bytes_per_action"].items()):
+            lines.append(f"- {action}: {self.format_size(size)}")
+        for device_pair, pair in sorted(estimate["pairs"].items()):
+            source = "measured" if pair["measured"] else "assumed"
+            lines.append(
+                f"- Copy {self.format_size(pair['bytes'])} in {pair['files']} files over device {device_pair} "
+                f"({source} {self.format_size(pair['throughput'])}/s)"
+            )
+        if estimate["metadata_ops"]:
+            lines.append(f"- {estimate['metadata_ops']} renames/deletes (no data copied)")
+        lines.append(f"Estimated duration: {self.format_duration(estimate['seconds'])}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def load_throughput_history():
+        """Return the average throughput of recent runs.
+        
+        The result has "pairs" (bytes/s per source->destination device pair) and
+        "metadata_ops_per_second" when measurements are available.
+        """
+        try:
+            with open(THROUGHPUT_HISTORY_PATH, 'r', encoding='utf-8') as f:
+                runs = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        
+        totals = collections.defaultdict(lambda: [0, 0, 0.0])
+        for run in runs:
+            for key, stats in run.items():
+                totals[key][0] += stats["bytes"]
+                totals[key][1] += stats["ops"]
+                totals[key][2] += stats["seconds"]
+        
+        history = {"pairs": {}}
+        for key, (total_bytes, ops, seconds) in totals.items():
+            if seconds <= 0:
+                continue
+            if key == "metadata":
+                history["metadata_ops_per_second"] = ops / seconds
+            elif total_bytes >= MIN_MEASURED_BYTES:
+                history["pairs"][key] = total_bytes / seconds
+        return history
+
+    @staticmethod
+    def save_throughput_history(run_stats):
+        """Append the measurements of a run, keeping the last THROUGHPUT_HISTORY_RUNS runs."""
+        if not run_stats:
+            return
+        try:
+            with open(THROUGHPUT_HISTORY_PATH, 'r', encoding='utf-8') as f:
+                runs = json.load(f)
+        except (OSError, ValueError):
+            runs = []
+        
+        runs.append(dict(run_stats))
+        try:
+            os.makedirs(STATE_DIR, exist_ok=True)
+            with open(THROUGHPUT_HISTORY_PATH, 'w', encoding='utf-8') as f:
+                json.dump(runs[-THROUGHPUT_HISTORY_RUNS:], f)
+        except OSError as e:
+            print(f"Error saving throughput history: {e}")
+
+    @staticmethod
+    def _throttled_copy(src, dst, throttle):
+        """copy2 replacement that reads and writes in chunks paced by the I/O throttle."""
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            for chunk in iter(lambda: fsrc.read(1024 * 1024), b""):
+                # Reading and writing the chunk are two I/O operations
+                throttle.consume(2 * len(chunk), ops=2)
+                fdst.write(chunk)
+        shutil.copystat(src, dst)
+        return dst
+
+    @staticmethod
+    def _verified_copy(src, dst, digest, throttle=None):
+        """copy2 replacement that hashes the data while copying it and checks it against digest.
+        
+        The digest is computed like calculate_checksum (tree hash for large files), so
+        the copy is verified without reading the file again. Kernel copies (sendfile,
+        copy_file_range) would skip the hashing, so this copies through a large buffer.
+        The copy is flushed to disk before returning; on a mismatch it is removed and
+        ValueError is raised.
+        """
+        buffer = bytearray(COPY_BUFFER_SIZE)
+        view = memoryview(buffer)
+        with open(src, 'rb', buffering=0) as fsrc, open(dst, 'wb', buffering=0) as fdst:
+            tree = os.fstat(fsrc.fileno()).st_size > TREE_HASH_MIN_SIZE
+            hasher = xxhash.xxh64()
+            range_digests = []
+            in_range = 0
+            while True:
+                length = fsrc.readinto(buffer)
+                if not length:
+                    break
+                chunk = view[:length]
+                if throttle is not None:
+                    # Reading and writing the chunk are two I/O operations
+                    throttle.consume(2 * length, ops=2)
                 
-                except Exception as e:
-                    error_count += 1
-                    print(f"Error processing {file_data['origin_path']}: {e}")
+                if tree:
+                    # Hash the same fixed ranges as tree_hash
+                    offset = 0
+                    while offset < length:
+                        take = min(length - offset, TREE_HASH_RANGE_SIZE - in_range)
+                        hasher.update(chunk[offset:offset + take])
+                        in_range += take
+                        offset += take
+                        if in_range == TREE_HASH_RANGE_SIZE:
+                            range_digests.append(hasher.digest())
+                            hasher = xxhash.xxh64()
+                            in_range = 0
+                else:
+                    hasher.update(chunk)
                 
-                # Update progress
-                processed_files += 1
-                progress_percentage = (processed_files / total_files) * 100
-                self.progress_var.set(progress_percentage)
-                self.progress_label.config(text=f"Executing actions: {int(progress_percentage)}%")
-                self.update_idletasks()
+                written = 0
+                while written < length:
+                    written += fdst.write(chunk[written:])
+            os.fsync(fdst.fileno())
+        
+        if tree:
+            if in_range:
+                range_digests.append(hasher.digest())
+            copied = xxhash.xxh64(b"".join(range_digests)).hexdigest()
+        else:
+            copied = hasher.hexdigest()
+        if copied != digest:
+            os.remove(dst)
+            raise ValueError(f"{src} changed since the comparison; the copy was not kept")
+        
+        shutil.copystat(src, dst)
+        return dst
+
+    @staticmethod
+    def _perform_action(entry, throttle=None, known_dirs=None):
+        """Perform a single planned operation.
+        
+        Operations are idempotent with respect to an interruption right after they
+        finished but before the journal recorded them: an entry whose effect is
+        already visible on disk is treated as done. known_dirs is a set of
+        directories known to exist, shared by the operations of a run.
+        """
+        origin_path = entry["origin_path"]
+        dest_path = entry["dest_path"]
+        
+        if throttle is not None and throttle.is_limited():
+            copy_function = lambda src, dst: BackupCleaner._throttled_copy(src, dst, throttle)
+            # Renames and deletes count as one metadata operation
+            throttle.consume(0)
+        else:
+            # Without limits keep copy2's fast platform copy (sendfile, CopyFile)
+            copy_function = shutil.copy2
+        
+        if entry["action"] == "Move":
+            if not os.path.exists(origin_path) and os.path.exists(dest_path):
+                return
+            
+            # Create target directory if it doesn't exist
+            BackupCleaner._ensure_directory(os.path.dirname(dest_path), known_dirs)
+            
+            # Move the file (a rename on one device, otherwise a copy)
+            shutil.move(origin_path, dest_path, copy_function=copy_function)
         
-        # Clean up empty directories in origin folder
-        self.cleanup_empty_directories(origin_folder)
+        elif entry["action"] == "Delete":
+            if not os.path.exists(origin_path):
+                return
+            
+            # Never delete the last copy: the matching file (possibly only known from a
+            # manifest, or the kept copy of a duplicate) must still be there with the same size
+            keep_paths = entry.get("keep_paths")
+            if keep_paths and not any(BackupCleaner._has_size(path, entry["size"]) for path in keep_paths):
+                raise ValueError(f"Matching file missing or changed: {keep_paths[0]}")
+            
+            # Delete the file
+            os.remove(origin_path)
         
-        # Update status and show message
-        self.status_var.set(f"Actions completed. Success: {success_count}, Errors: {error_count}")
-        self.progress_label.config(text="Actions completed")
-        messagebox.showinfo("Actions Completed", f"Actions completed.\nSuccess: {success_count}\nErrors: {error_count}")
+        else:
+            if not os.path.exists(origin_path) and os.path.exists(dest_path):
+                return
+            
+            # Create target directory if it doesn't exist
+            BackupCleaner._ensure_directory(os.path.dirname(dest_path), known_dirs)
+            
+            # Copy the file with _v2 suffix (a partial copy from an interrupted run is overwritten),
+            # checking it against the digest of the comparison before the original is removed
+            if entry.get("digest"):
+                BackupCleaner._verified_copy(
+                    origin_path, dest_path, entry["digest"],
+                    throttle if throttle is not None and throttle.is_limited() else None
+                )
+            else:
+                copy_function(origin_path, dest_path)
+            
+            # Delete the original file after copying
+            os.remove(origin_path)
+
+    @staticmethod
+    def _has_size(path, size):
+        try:
+            return os.path.getsize(path) == size
+        except OSError:
+            return False
+
+    @staticmethod
+    def _ensure_directory(path, known_dirs=None):
+        """Create a directory (and its parents) unless it is already in known_dirs."""
+        if known_dirs is not None and path in known_dirs:
+            return
+        os.makedirs(path, exist_ok=True)
+        if known_dirs is not None:
+            known_dirs.add(path)
+
+    def check_unfinished_journal(self):
+        """Offer to finish an action plan that was interrupted by a crash or restart."""
+        journal = ActionJournal.load(JOURNAL_PATH)
+        if journal is None:
+            return
         
-        # Refresh the file list
-        self.compare_folders()
+        remaining = len(journal.plan) - len(journal.done)
+        resume = messagebox.askyesno(
+            "Resume Actions",
+            f"A previous run of actions was interrupted.\n\n"
+            f"Origin Folder: {journal.origin_folder}\n"
+            f"Target Folder: {journal.target_folder}\n"
+            f"{len(journal.done)} of {len(journal.plan)} actions were completed, {remaining} remaining.\n\n"
+            f"Continue the remaining actions? Choose No to discard the journal."
+        )
+        if not resume:
+            journal.close()
+            journal.remove()
+            return
+        
+        self.origin_folder_var.set(journal.origin_folder)
+        self.target_folder_var.set(journal.target_folder)
+        
+        self.analyze_plan(journal.plan, self.load_throughput_history())
+        success_count, error_count = self.run_journaled_plan(journal, journal.plan)
+        self.cleanup_empty_directories(journal.origin_folder)
+        
+        self.status_var.set(f"Resumed actions completed. Success: {success_count}, Errors: {error_count}")
+        self.progress_label.config(text="Actions completed")
+        messagebox.showinfo("Actions Completed", f"Resumed actions completed.\nSuccess: {success_count}\nErrors: {error_count}")
 
     def cleanup_empty_directories(self, directory):
         """Recursively remove empty directories."""
@@ -700,7 +2547,7 @@ class BackupCleaner(tk.Tk):
             empty_dirs_found = False
             
             # Walk bottom-up to find empty directories
-            for root, dirs, files in os.walk(directory, topdown=False):
+            for root, dirs, files in self.parallel_walk(directory, topdown=False):
                 # Skip the base directory itself
                 if root == directory:
                     continue
@@ -746,7 +2593,15 @@ class BackupCleaner(tk.Tk):
                 f.write(f"Origin Folder: {self.origin_folder_var.get()}\n")
                 f.write(f"Target Folder: {self.target_folder_var.get()}\n")
                 f.write(f"Search in different locations: {self.search_different_locations_var.get()}\n")
+                f.write(f"Analyze near-duplicates: {self.near_duplicates_var.get()}\n")
+                if self.near_duplicate_bytes is not None:
+                    f.write(f"  Near-duplicate data already in target: {self.format_size(self.near_duplicate_bytes)}\n")
+                f.write(f"Exclude: {self.exclude_var.get()}\n")
+                f.write(f"Include: {self.include_var.get()}\n")
+                for line in self.filter_summary:
+                    f.write(f"  Skipped by {line}\n")
                 f.write(f"Total files analyzed: {len(self.file_data)}\n")
+                f.write(f"Stat calls saved by reusing scan metadata: {self.stat_calls_saved}\n")
                 f.write("=" * 80 + "\n\n")
                 
                 # Write test summary statistics
@@ -772,7 +2627,7 @@ class BackupCleaner(tk.Tk):
                 
                 for i, item in enumerate(self.file_data, 1):
                     f.write(f"File #{i}:\n")
-                    f.write(f"  Origin Path: {item['origin_path']}\n")
+                    f.write(f"  Origin Path: {item['origin_path'] if item['origin_path'] else 'None'}\n")
                     f.write(f"  Target Path: {item['target_path'] if item['target_path'] else 'None'}\n")
                     f.write(f"  Size: {self.format_size(item['size'])}\n")
                     f.write(f"  Match Type: {item['match_type']}\n")
@@ -805,11 +2660,11 @@ class BackupCleaner(tk.Tk):
                 f.write(f"Scenario 5 - Files only in origin: {len(files_only_in_origin)} files\n")
                 
                 # Nested folder structure
-                nested_folder_files = [item for item in self.file_data if "/folder" in item['origin_path'].replace("\\", "/")]
+                nested_folder_files = [item for item in self.file_data if "/folder" in (item['origin_path'] or "").replace("\\", "/")]
                 f.write(f"Scenario 6 - Nested folder structure: {len(nested_folder_files)} files\n")
                 
                 # Files in different locations
-                diff_location_files = [item for item in self.file_data if item['target_path'] and os.path.dirname(item['origin_path']) != os.path.dirname(item['target_path'])]
+                diff_location_files = [item for item in self.file_data if item['origin_path'] and item['target_path'] and os.path.dirname(item['origin_path']) != os.path.dirname(item['target_path'])]
                 f.write(f"Scenario 7 - Files in different locations: {len(diff_location_files)} files\n")
                 
                 # Files with multiple matches
@@ -822,15 +2677,21 @@ class BackupCleaner(tk.Tk):
                 
                 # Files with same parent folder in different locations
                 same_parent_diff_loc = [item for item in self.file_data if 
-                                      item['target_path'] and 
+                                      item['origin_path'] and item['target_path'] and 
                                       os.path.basename(os.path.dirname(item['origin_path'])) == os.path.basename(os.path.dirname(item['target_path'])) and
                                       os.path.dirname(item['origin_path']) != os.path.dirname(item['target_path'])]
                 f.write(f"Scenario 11 - Same parent folder in different locations: {len(same_parent_diff_loc)} files\n")
                 
                 # Files with special characters
-                special_char_files = [item for item in self.file_data if "special_chars" in item['origin_path']]
+                special_char_files = [item for item in self.file_data if "special_chars" in (item['origin_path'] or "")]
                 f.write(f"Scenario 12 - Files with special characters: {len(special_char_files)} files\n")
                 
+                # Files only in target (same layout mode)
+                target_only_files = [item for item in self.file_data if item['match_type'] == 'Target only']
+                if target_only_files:
+                    f.write(f"Files only in target: {len(target_only_files)} files "
+                            f"({self.format_size(sum(item['size'] for item in target_only_files))})\n")
+                
             # Show success message
             messagebox.showinfo("Export to Log", f"Comparison details successfully exported to:\n{log_file}")
             
@@ -852,6 +2713,60 @@ class BackupCleaner(tk.Tk):
         """Update the CPU percentage label when the slider value changes"""
         self.cpu_percent_label.config(text=f"{self.cpu_usage_var.get()}%")
 
+    def update_io_limits(self, *args):
+        """Apply the I/O limits from the UI to the shared throttle."""
+        try:
+            bytes_per_second = self.io_limit_var.get() * 1024 * 1024
+            ops_per_second = self.iops_limit_var.get()
+        except tk.TclError:
+            # Ignore incomplete input while the user is typing
+            return
+        self.io_throttle.set_limits(bytes_per_second, ops_per_second)
+
+    def on_cpu_slider_release(self, event=None):
+        """Resize an existing worker pool to the new CPU setting."""
+        self.update_cpu_label()
+        if self._pool is not None and not self.is_comparing:
+            self.get_pool()
+
+    def get_pool(self):
+        """Return the long-lived worker pool, creating it on first use.
+        
+        The pool is reused by all comparisons (including the refresh after executing
+        actions), so workers keep their warm state: the loaded target index and the
+        digest cache. It is recreated when the CPU slider or the idle I/O option changes.
+        """
+        config = (self.get_worker_count(), self.idle_io_var.get())
+        if self._pool is not None and self._pool_config == config:
+            return self._pool
+        
+        self.shutdown_pool()
+        self._pool = Pool(
+            processes=config[0],
+            initializer=backup_worker.init_worker,
+            initargs=(self.run_event, self.cancel_event, self.io_throttle, config[1])
+        )
+        self._pool_config = config
+        return self._pool
+
+    def shutdown_pool(self):
+        """Terminate the worker pool, if any."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            self._pool_config = None
+
+    def on_close(self):
+        """Close the window. A running comparison is cancelled first and the window
+        closes once it has stopped, since the compare loop still uses the widgets."""
+        if self.is_comparing:
+            self.close_requested = True
+            self.cancel_compare()
+            return
+        self.shutdown_pool()
+        self.destroy()
+
     def get_worker_count(self):
         """Calculate the number of worker processes based on CPU usage setting"""
         available_cpus = cpu_count()
@@ -866,6 +2781,75 @@ class BackupCleaner(tk.Tk):
             
         return worker_count
 
-if __name__ == "__main__":
+def main(argv=None):
+    """Run the GUI, or a command given on the command line."""
+    parser = argparse.ArgumentParser(description="Compare an origin folder against a backup and clean it up.")
+    commands = parser.add_subparsers(dest="command")
+    manifest_parser = commands.add_parser("manifest", help="write a manifest of a target folder")
+    manifest_parser.add_argument("folder", help="folder to list")
+    manifest_parser.add_argument("output", help="manifest file (.csv, .jsonl or .sqlite)")
+    manifest_parser.add_argument("--no-digests", action="store_true", help="list sizes and times only, without reading the files")
+    manifest_parser.add_argument("--workers", type=int, default=None, help="number of hashing processes")
+    
+    shard_parser = commands.add_parser("shard", help="compare one shard of the origin folder without the GUI")
+    shard_parser.add_argument("origin", help="origin folder")
+    shard_parser.add_argument("target", help="target folder")
+    shard_parser.add_argument("output", help="result file of the shard")
+    shard_parser.add_argument("--shard", type=int, default=0, help="shard to compare (0 to shards - 1)")
+    shard_parser.add_argument("--shards", type=int, default=1, help="number of shards")
+    shard_parser.add_argument("--manifest", help="target manifest to compare against")
+    shard_parser.add_argument("--different-locations", action="store_true",
+                              help="also search for matches in folders with the same name")
+    shard_parser.add_argument("--exclude", default="", help="exclude patterns, separated by ';'")
+    shard_parser.add_argument("--include", default="", help="include patterns, separated by ';'")
+    shard_parser.add_argument("--min-size-kb", type=float, default=None, help="skip smaller files")
+    shard_parser.add_argument("--max-size-mb", type=float, default=None, help="skip larger files")
+    shard_parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    
+    merge_parser = commands.add_parser("merge", help="combine the shard result files into a session")
+    merge_parser.add_argument("session", help="session file to write (open it with --session)")
+    merge_parser.add_argument("shard_files", nargs="+", help="result files of all shards")
+    
+    parser.add_argument("--session", help="open a merged session in the GUI")
+    args = parser.parse_args(argv)
+    
+    if args.command == "manifest":
+        count = BackupCleaner.write_manifest(args.folder, args.output, not args.no_digests, args.workers)
+        print(f"Wrote {count} files to {args.output}")
+        return
+    
+    if args.command == "shard":
+        if not 0 <= args.shard < args.shards:
+            parser.error("--shard must be between 0 and --shards - 1")
+        try:
+            rules, target_rules = (FilterRules(
+                include=FilterRules.parse_patterns(args.include),
+                exclude=FilterRules.parse_patterns(args.exclude),
+                min_size=int(args.min_size_kb * 1024) if args.min_size_kb is not None else None,
+                max_size=int(args.max_size_mb * 1024 * 1024) if args.max_size_mb is not None else None
+            ) for _ in range(2))
+        except re.error as e:
+            parser.error(f"Invalid regular expression: {e}")
+        manifest = BackupCleaner.load_manifest(args.manifest) if args.manifest else None
+        count = BackupCleaner.compare_shard(
+            args.origin, args.target, args.output, args.shard, args.shards, rules, target_rules,
+            manifest, args.different_locations, args.workers)
+        print(f"Compared {count} files of shard {args.shard} of {args.shards} into {args.output}")
+        return
+    
+    if args.command == "merge":
+        try:
+            count = BackupCleaner.merge_shards(args.shard_files, args.session)
+        except ValueError as e:
+            sys.exit(f"Error: {e}")
+        print(f"Merged {len(args.shard_files)} shards ({count} files) into {args.session}")
+        return
+    
     app = BackupCleaner()
+    if args.session:
+        app.after_idle(app.open_session, args.session)
     app.mainloop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,672 @@
+"""Comparison code run by the pool workers of backup_cleaner.
+
+Spawned workers import this module, not the GUI: it does not import tkinter, and
+modules only needed by some tasks are imported where they are used.
+"""
+import os
+import re
+import sys
+import time
+import collections
+import array
+import xxhash
+
+# Copy markers stripped when normalizing file names: "Copy of " prefixes and
+# " - Copy", " - Copy (2)", " (1)" and "_v2" suffixes (case-insensitive)
+_COPY_PREFIX_RE = re.compile(r'^(?:copy of )+', re.IGNORECASE)
+_COPY_SUFFIX_RE = re.compile(r'(?: - copy(?: \(\d+\))?| \(\d+\)|_v\d+)+$', re.IGNORECASE)
+
+# Kinds of comparison rows sent by the workers as one code each (see encode_results):
+# (match type, action, selected, color). Alternative matches are numbered, and the best
+# of several matches carries their count.
+_ROW_KINDS = [
+    ("No match", "Move", False, None),
+    ("Exact match", "Delete", True, "green"),
+    ("Name match", "Copy as _v2", True, "orange"),
+    ("Size match", "Copy as _v2", True, "blue"),
+    ("Alternative match", "Skip", False, None),
+    ("Likely exact match (unverified)", "Verify", False, None),
+    ("Size match (unverified)", "Verify", False, None),
+]
+_ROW_KIND_CODES = {kind: code for code, kind in enumerate(_ROW_KINDS)}
+_ALTERNATIVE_KIND = 4
+
+# Files larger than TREE_HASH_MIN_SIZE are hashed as fixed TREE_HASH_RANGE_SIZE ranges,
+# TREE_HASH_THREADS at a time; the file digest is the xxh64 of the range digests, so it
+# does not depend on the number of threads
+TREE_HASH_MIN_SIZE = 100 * 1024 * 1024
+TREE_HASH_RANGE_SIZE = 64 * 1024 * 1024
+TREE_HASH_THREADS = 4
+
+# Digest type written to and accepted from target manifests ("<type>:<hex digest>")
+MANIFEST_DIGEST_TYPE = "xxh64tree"
+
+# Warm state kept by each process between comparisons: digests by (path, size, mtime)
+DIGEST_CACHE_SIZE = 200000
+_digest_cache = collections.OrderedDict()
+
+# Content-defined chunking for near-duplicate analysis: chunk boundaries are where the
+# top CDC_MASK_BITS bits of a gear rolling hash are zero (~8 KB average chunks), so an
+# insertion only changes the chunks around it. Larger files are not analyzed.
+CDC_MIN_CHUNK = 2 * 1024
+CDC_MAX_CHUNK = 64 * 1024
+CDC_MASK_BITS = 13
+NEAR_DUPLICATE_MAX_SIZE = 64 * 1024 * 1024
+_CDC_MASK = ((1 << CDC_MASK_BITS) - 1) << (64 - CDC_MASK_BITS)
+_GEAR = [xxhash.xxh64(bytes([i])).intdigest() for i in range(256)]
+
+# Events and I/O throttle shared with pool workers (set in init_worker)
+_worker_run_event = None
+_worker_cancel_event = None
+_worker_throttle = None
+
+# Target index (and manifest) of the current comparison, loaded once per worker (see get_target_index)
+_worker_target_index = None
+_worker_target_manifest = None
+_worker_index_token = None
+
+
+class IOThrottle:
+    """Token-bucket rate limiter for bytes/s and ops/s.
+    
+    The buckets live in shared memory, so one instance passed to the pool workers
+    (through the pool initializer) limits all hashing workers and the action
+    executor together. Limits can be changed at any time with set_limits; a limit
+    of 0 means unlimited. Callers may take more tokens than are available: the
+    bucket goes into debt and the caller sleeps until it is paid back.
+    """
+    
+    def __init__(self):
+        import multiprocessing
+        self._lock = multiprocessing.Lock()
+        # bytes/s, ops/s, byte tokens, op tokens, last refill time
+        self._state = multiprocessing.Array('d', [0.0, 0.0, 0.0, 0.0, time.monotonic()], lock=False)
+    
+    def set_limits(self, bytes_per_second, ops_per_second):
+        with self._lock:
+            self._state[0] = max(0.0, float(bytes_per_second))
+            self._state[1] = max(0.0, float(ops_per_second))
+            # Start with a full bucket (one second worth of tokens)
+            self._state[2] = self._state[0]
+            self._state[3] = self._state[1]
+            self._state[4] = time.monotonic()
+    
+    def is_limited(self):
+        """Return True if a bytes/s or ops/s limit is currently set."""
+        return self._state[0] > 0 or self._state[1] > 0
+    
+    def consume(self, nbytes=0, ops=1):
+        """Take tokens for an I/O operation, sleeping as long as the limits require."""
+        state = self._state
+        if state[0] <= 0 and state[1] <= 0:
+            return
+        
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - state[4]
+            state[4] = now
+            wait = 0.0
+            for rate_index, tokens_index, amount in ((0, 2, nbytes), (1, 3, ops)):
+                rate = state[rate_index]
+                if rate <= 0:
+                    continue
+                # Refill, capping the burst to one second worth of tokens
+                tokens = min(rate, state[tokens_index] + elapsed * rate) - amount
+                state[tokens_index] = tokens
+                if tokens < 0:
+                    wait = max(wait, -tokens / rate)
+        
+        if wait > 0:
+            time.sleep(wait)
+
+
+def init_worker(run_event, cancel_event, throttle=None, idle_io_priority=False):
+    """Pool initializer that gives each worker the shared pause/cancel events and I/O throttle."""
+    global _worker_run_event, _worker_cancel_event, _worker_throttle
+    _worker_run_event = run_event
+    _worker_cancel_event = cancel_event
+    _worker_throttle = throttle
+    if idle_io_priority:
+        set_idle_io_priority()
+
+
+def set_idle_io_priority():
+    """Lower the I/O priority of the current process, using the idle class where supported."""
+    try:
+        try:
+            import psutil
+        except ImportError:
+            psutil = None
+        if psutil is not None:
+            if sys.platform.startswith("linux"):
+                psutil.Process().ionice(psutil.IOPRIO_CLASS_IDLE)
+                return
+            if sys.platform == "win32":
+                psutil.Process().ionice(psutil.IOPRIO_VERYLOW)
+                return
+        if hasattr(os, "nice"):
+            # Without an explicit I/O class, Linux derives the I/O priority from the CPU niceness
+            os.nice(19)
+    except Exception as e:
+        print(f"Error setting idle I/O priority: {e}")
+
+
+def wait_if_paused():
+    """Block while the comparison is paused. Returns False if it was cancelled."""
+    if _worker_run_event is not None:
+        _worker_run_event.wait()
+    return _worker_cancel_event is None or not _worker_cancel_event.is_set()
+
+
+def process_file_batch(args):
+    """Compare a batch of origin files with the target (run by the pool workers).
+    
+    args is (files, params, their (size, mtime_ns) or None, whether each file must be
+    hashed even without target candidates, to find duplicates within the origin).
+    """
+    batch, params, batch_stats, hash_origins = args
+    origin_folder = params['origin_folder']
+    target_folder = params['target_folder']
+    search_different_locations = params['search_different_locations']
+    near_duplicates = params.get('near_duplicates', False)
+    metadata_only = params.get('metadata_only', False)
+    same_layout = params.get('same_layout', False)
+    
+    target_index, manifest = get_target_index(params)
+    
+    results = []
+    
+    for origin_file_path, origin_stat, hash_origin in zip(batch, batch_stats, hash_origins):
+        # Stop early on Pause/Cancel; partial batches are never checkpointed
+        if not wait_if_paused():
+            break
+        
+        # Extract relative path
+        rel_path = os.path.relpath(origin_file_path, origin_folder)
+        
+        # Stat each path at most once: origin and target metadata come from the
+        # scan (or the manifest) and are passed on to the checksum calculation
+        stat_calls_saved = 0
+        if origin_stat is None:
+            stat_result = os.stat(origin_file_path)
+            origin_stat = (stat_result.st_size, stat_result.st_mtime_ns)
+        else:
+            stat_calls_saved += 1
+        file_size = origin_stat[0]
+        filename = os.path.basename(origin_file_path)
+        
+        # Find potential matching files: every target file with the same normalized
+        # name, in the same relative folder or (optionally) a folder with the same name.
+        # In same layout mode, only the target file at the same relative path.
+        rel_dir = os.path.dirname(rel_path)
+        parent_folder_name = os.path.basename(rel_dir)
+        potential_matches = []
+        if same_layout and rel_path in manifest:
+            potential_matches.append(os.path.join(target_folder, rel_path))
+        for target_rel_path in target_index.get(normalize_name(filename), ()):
+            target_rel_dir = os.path.dirname(target_rel_path)
+            if target_rel_dir == rel_dir or (
+                    search_different_locations and parent_folder_name
+                    and os.path.basename(target_rel_dir) == parent_folder_name):
+                potential_matches.append(os.path.join(target_folder, target_rel_path))
+        
+        # Check for matches
+        matches = []
+        origin_checksum = None
+        
+        # (size, mtime_ns) of every file the result depends on, to validate checkpoints
+        stats = {origin_file_path: list(origin_stat)}
+        
+        for potential_match in potential_matches:
+            # Target metadata from the manifest file or the scan; a manifest digest
+            # means the target file is not read at all
+            entry = manifest.get(os.path.relpath(potential_match, target_folder)) if manifest else None
+            if entry is not None:
+                target_size, target_mtime_ns, target_checksum = entry
+                stat_calls_saved += 1
+            else:
+                # Get basic file info (the file may have disappeared since indexing)
+                try:
+                    target_stat = os.stat(potential_match)
+                except OSError:
+                    continue
+                target_size = target_stat.st_size
+                target_mtime_ns = target_stat.st_mtime_ns
+                target_checksum = None
+            stats[potential_match] = [target_size, target_mtime_ns]
+            
+            # Quick mode: a candidate of the same size can only be classified by hashing,
+            # which the verification pass does later
+            if metadata_only:
+                if target_size == file_size:
+                    same_mtime = target_mtime_ns == origin_stat[1]
+                    matches.append({
+                        "target_path": potential_match,
+                        "match_type": "Likely exact match (unverified)" if same_mtime else "Size match (unverified)",
+                        "proposed_action": "Verify",
+                        "selected": False,
+                        "color": None,
+                        "rank": 0 if same_mtime else 1
+                    })
+                    continue
+                if os.path.basename(origin_file_path) == os.path.basename(potential_match):
+                    matches.append({
+                        "target_path": potential_match,
+                        "match_type": "Name match",
+                        "proposed_action": "Copy as _v2",
+                        "selected": True,
+                        "color": "orange",
+                        "rank": 2
+                    })
+                continue
+            
+            # Only calculate the origin checksum once, and only when there is a candidate
+            if origin_checksum is None:
+                origin_checksum = calculate_checksum(origin_file_path, origin_stat)
+                stat_calls_saved += 1
+            if target_checksum is None:
+                target_checksum = calculate_checksum(potential_match, (target_size, target_mtime_ns))
+                stat_calls_saved += 1
+            
+            # Check if exact duplicate (same content)
+            if origin_checksum == target_checksum:
+                matches.append({
+                    "target_path": potential_match,
+                    "match_type": "Exact match",
+                    "proposed_action": "Delete",
+                    "selected": True,
+                    "color": "green",
+                    "rank": 0
+                })
+            # Check if same name, different content
+            elif os.path.basename(origin_file_path) == os.path.basename(potential_match):
+                matches.append({
+                    "target_path": potential_match,
+                    "match_type": "Name match",
+                    "proposed_action": "Copy as _v2",
+                    "selected": True,
+                    "color": "orange",
+                    "rank": 2
+                })
+            # Check if same size, different content
+            elif file_size == target_size:
+                matches.append({
+                    "target_path": potential_match,
+                    "match_type": "Size match",
+                    "proposed_action": "Copy as _v2",
+                    "selected": True,
+                    "color": "blue",
+                    "rank": 1
+                })
+        
+        # Create result entry
+        result = {}
+        
+        # If we found matches
+        if matches:
+            # Handle multiple matches
+            if len(matches) > 1:
+                # Sort matches by priority: Exact match > Size match > Name match
+                sorted_matches = sorted(matches, key=lambda x: x["rank"])
+                
+                # Add the best match to results
+                best_match = sorted_matches[0]
+                result = {
+                    'origin_path': origin_file_path,
+                    'target_path': best_match["target_path"],
+                    'size': file_size,
+                    'match_type': f"{best_match['match_type']} (multiple matches: {len(matches)})",
+                    'action': best_match["proposed_action"],
+                    'selected': best_match["selected"],
+                    'color': best_match["color"]
+                }
+                
+                # Add other matches with different proposed action
+                for i, match in enumerate(sorted_matches[1:]):
+                    results.append({
+                        'origin_path': origin_file_path,
+                        'target_path': match["target_path"],
+                        'size': file_size,
+                        'match_type': f"Alternative match #{i+1}",
+                        'action': "Skip",  # We skip alternative matches by default
+                        'selected': False,
+                        'color': None
+                    })
+            else:
+                # Single match
+                match = matches[0]
+                result = {
+                    'origin_path': origin_file_path,
+                    'target_path': match["target_path"],
+                    'size': file_size,
+                    'match_type': match["match_type"],
+                    'action': match["proposed_action"],
+                    'selected': match["selected"],
+                    'color': match["color"]
+                }
+        else:
+            # No matches found
+            result = {
+                'origin_path': origin_file_path,
+                'target_path': None,
+                'size': file_size,
+                'match_type': "No match",
+                'action': "Move",
+                'selected': False,
+                'color': None
+            }
+        
+        # Chunk "Copy as _v2" candidates for near-duplicate analysis; the parent
+        # scores them against the chunks of every analyzed target file
+        if (near_duplicates and not metadata_only and result['action'] == "Copy as _v2"
+                and file_size <= NEAR_DUPLICATE_MAX_SIZE):
+            result['chunks'] = {
+                'origin': content_chunks(origin_file_path),
+                'targets': [
+                    content_chunks(match["target_path"])
+                    for match in matches
+                    if match["match_type"] != "Exact match"
+                    and stats[match["target_path"]][0] <= NEAR_DUPLICATE_MAX_SIZE
+                ],
+            }
+        
+        # Quick mode: rows with candidates (or possible origin duplicates) are verified
+        # later, those that could reclaim the most bytes first
+        if metadata_only:
+            result['provisional'] = bool(matches) or hash_origin
+            result['reclaimable'] = file_size if hash_origin or any(
+                match["proposed_action"] == "Verify" for match in matches) else 0
+        
+        # Files sharing their size with other origin files are hashed in this same pass
+        elif origin_checksum is None and hash_origin:
+            origin_checksum = calculate_checksum(origin_file_path, origin_stat)
+            stat_calls_saved += 1
+        
+        # Keep the origin digest for directory-level (Merkle) comparison and duplicate detection
+        result['digest'] = origin_checksum
+        result['stats'] = stats
+        result['stat_calls_saved'] = stat_calls_saved
+        results.append(result)
+    
+    return results
+
+
+def process_file_batch_encoded(args):
+    """process_file_batch for the pool: returns the results encoded (see encode_results)."""
+    batch, params = args[0], args[1]
+    return encode_results(process_file_batch(args), batch, params['target_folder'])
+
+
+def encode_results(results, batch, target_folder):
+    """Pack the result rows of a batch into a few flat arrays.
+    
+    Origin files are sent as their index in the batch, target files as an index
+    into a table of paths relative to target_folder, and match types, actions,
+    selection and colors as one code (_ROW_KINDS). Checkpoint stats and digests
+    become number columns. The result pickles (and saves as JSON) without
+    per-row dicts or repeated strings; decode_results restores the rows.
+    """
+    origin_ids = {path: i for i, path in enumerate(batch)}
+    targets = []
+    target_ids = {}
+    
+    def target_id(path):
+        if path not in target_ids:
+            target_ids[path] = len(targets)
+            targets.append(os.path.relpath(path, target_folder))
+        return target_ids[path]
+    
+    encoded = {
+        'targets': targets,
+        'origin': array.array('l'),
+        'target': array.array('l'),
+        'size': array.array('q'),
+        'kind': array.array('b'),
+        'extra': array.array('l'),
+        # Main rows only (alternatives have no digest and stats): digest (0 if none)
+        # and origin mtime, and the (size, mtime) of every candidate target
+        'main': array.array('b'),
+        'digest': array.array('Q'),
+        'mtime': array.array('q'),
+        'stat_row': array.array('l'),
+        'stat_target': array.array('l'),
+        'stat_size': array.array('q'),
+        'stat_mtime': array.array('q'),
+        'stat_calls_saved': 0,
+        'chunks': [],
+    }
+    for row, result in enumerate(results):
+        origin_path = result['origin_path']
+        match_type = result['match_type']
+        if match_type.startswith("Alternative match #"):
+            kind = _ALTERNATIVE_KIND
+            extra = int(match_type.rsplit("#", 1)[1])
+        else:
+            match_type, multiple, count = match_type.partition(" (multiple matches: ")
+            kind = _ROW_KIND_CODES[(match_type, result['action'], result['selected'], result['color'])]
+            extra = int(count[:-1]) if multiple else 0
+        encoded['origin'].append(origin_ids[origin_path])
+        encoded['target'].append(target_id(result['target_path']) if result['target_path'] else -1)
+        encoded['size'].append(result['size'])
+        encoded['kind'].append(kind)
+        encoded['extra'].append(extra)
+        
+        main = 'stats' in result
+        encoded['main'].append(main)
+        if main:
+            digest = result['digest']
+            encoded['digest'].append(int(digest, 16) if digest else 0)
+            encoded['mtime'].append(result['stats'][origin_path][1])
+            for path, (size, mtime_ns) in result['stats'].items():
+                if path != origin_path:
+                    encoded['stat_row'].append(row)
+                    encoded['stat_target'].append(target_id(path))
+                    encoded['stat_size'].append(size)
+                    encoded['stat_mtime'].append(mtime_ns)
+        else:
+            encoded['digest'].append(0)
+            encoded['mtime'].append(0)
+        encoded['stat_calls_saved'] += result.get('stat_calls_saved', 0)
+        if 'chunks' in result:
+            encoded['chunks'].append((row, result['chunks']))
+    return encoded
+
+
+def decode_results(encoded, batch, target_folder):
+    """Rebuild the result rows of a batch from encode_results (or its JSON form)."""
+    targets = [os.path.join(target_folder, rel_path) for rel_path in encoded['targets']]
+    candidate_stats = collections.defaultdict(list)
+    for row, target, size, mtime_ns in zip(encoded['stat_row'], encoded['stat_target'],
+                                           encoded['stat_size'], encoded['stat_mtime']):
+        candidate_stats[row].append((targets[target], [size, mtime_ns]))
+    
+    results = []
+    for row, (origin, target, size, kind, extra, main, digest, mtime_ns) in enumerate(zip(
+            encoded['origin'], encoded['target'], encoded['size'], encoded['kind'],
+            encoded['extra'], encoded['main'], encoded['digest'], encoded['mtime'])):
+        match_type, action, selected, color = _ROW_KINDS[kind]
+        if kind == _ALTERNATIVE_KIND:
+            match_type = f"{match_type} #{extra}"
+        elif extra:
+            match_type = f"{match_type} (multiple matches: {extra})"
+        origin_path = batch[origin]
+        result = {
+            'origin_path': origin_path,
+            'target_path': targets[target] if target >= 0 else None,
+            'size': size,
+            'match_type': match_type,
+            'action': action,
+            'selected': selected,
+            'color': color
+        }
+        if main:
+            result['digest'] = format(digest, '016x') if digest else None
+            result['stats'] = {origin_path: [size, mtime_ns]}
+            result['stats'].update(candidate_stats[row])
+        results.append(result)
+    for row, chunks in encoded.get('chunks', ()):
+        results[row]['chunks'] = chunks
+    return results
+
+
+def encoded_to_json(encoded):
+    """The JSON form of encode_results (arrays as lists), as stored in checkpoints."""
+    return {key: value.tolist() if isinstance(value, array.array) else value for key, value in encoded.items()}
+
+
+def normalize_name(filename):
+    """Return the key under which copies of a file are matched.
+    
+    The name is lowercased and copy markers are removed, so "Photo - Copy (2).JPG",
+    "Copy of photo.jpg", "photo (1).jpg" and "photo_v2.jpg" all map to "photo.jpg".
+    """
+    stem, ext = os.path.splitext(filename.lower())
+    stem = _COPY_PREFIX_RE.sub('', stem)
+    stem = _COPY_SUFFIX_RE.sub('', stem)
+    return stem + ext
+
+
+def manifest_row(args):
+    """Return the manifest row of one file (for write_manifest's pool)."""
+    path, rel_path, with_digests, stat = args
+    if stat is None:
+        stat_result = os.stat(path)
+        stat = (stat_result.st_size, stat_result.st_mtime_ns)
+    digest = ""
+    if with_digests:
+        digest = f"{MANIFEST_DIGEST_TYPE}:{calculate_checksum(path, stat)}"
+    return rel_path.replace(os.sep, "/"), stat[0], stat[1], digest
+
+
+def get_target_index(params):
+    """Return the target index and manifest (or None) of the current comparison.
+    
+    Pool workers live across comparisons, so they keep the last loaded index and
+    only reload it when the parent publishes a new one (a new index_token). Called
+    in-process, params may hold the index itself instead.
+    """
+    global _worker_target_index, _worker_target_manifest, _worker_index_token
+    if 'target_index' in params:
+        # Called in-process with the index itself (quick mode)
+        return params['target_index'], params.get('manifest')
+    token = params['index_token']
+    if token != _worker_index_token:
+        import pickle
+        with open(params['index_path'], 'rb') as f:
+            _worker_target_index, _worker_target_manifest = pickle.load(f)
+        _worker_index_token = token
+    return _worker_target_index, _worker_target_manifest
+
+
+def calculate_checksum(file_path, stat=None):
+    """Calculate the xxHash (xxh64) checksum of a file; large files get a parallel tree hash.
+    
+    stat is the file's (size, mtime_ns) if the caller already knows it.
+    """
+    if stat is None:
+        stat_result = os.stat(file_path)
+        stat = (stat_result.st_size, stat_result.st_mtime_ns)
+    file_size = stat[0]
+    
+    # Reuse the digest from an earlier comparison if the file did not change
+    cache_key = (file_path, file_size, stat[1])
+    digest = _digest_cache.get(cache_key)
+    if digest is not None:
+        _digest_cache.move_to_end(cache_key)
+        return digest
+    
+    if file_size > TREE_HASH_MIN_SIZE:
+        digest = tree_hash(file_path, file_size)
+    else:
+        hasher = xxhash.xxh64()
+        throttle = _worker_throttle
+        with open(file_path, "rb") as f:
+            # Read in 1MB chunks
+            for byte_block in iter(lambda: f.read(1024 * 1024), b""):
+                hasher.update(byte_block)
+                if throttle is not None:
+                    throttle.consume(len(byte_block))
+        digest = hasher.hexdigest()
+    
+    _digest_cache[cache_key] = digest
+    if len(_digest_cache) > DIGEST_CACHE_SIZE:
+        _digest_cache.popitem(last=False)
+    return digest
+
+
+def tree_hash(file_path, file_size, range_size=TREE_HASH_RANGE_SIZE, threads=TREE_HASH_THREADS):
+    """Hash the whole file as ranges read concurrently (xxhash and reads release the GIL).
+    
+    The digest covers every byte and depends only on the content and range_size.
+    """
+    throttle = _worker_throttle
+    
+    def hash_range(f, offset):
+        hasher = xxhash.xxh64()
+        end = min(offset + range_size, file_size)
+        while offset < end:
+            length = min(1024 * 1024, end - offset)
+            if hasattr(os, "pread"):
+                block = os.pread(f.fileno(), length, offset)
+            else:
+                f.seek(offset)
+                block = f.read(length)
+            if not block:
+                break
+            hasher.update(block)
+            if throttle is not None:
+                throttle.consume(len(block))
+            offset += len(block)
+        return hasher.digest()
+    
+    def hash_range_own_handle(offset):
+        # Without pread the file position is shared, so every range needs its own handle
+        with open(file_path, "rb") as f:
+            return hash_range(f, offset)
+    
+    import concurrent.futures
+    offsets = range(0, file_size, range_size)
+    with open(file_path, "rb") as f:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+            if hasattr(os, "pread"):
+                range_digests = executor.map(lambda offset: hash_range(f, offset), offsets)
+            else:
+                range_digests = executor.map(hash_range_own_handle, offsets)
+            return xxhash.xxh64(b"".join(range_digests)).hexdigest()
+
+
+def content_chunks(file_path):
+    """Split a file into content-defined chunks. Returns a list of (xxh64, length)."""
+    gear = _GEAR
+    mask = _CDC_MASK
+    throttle = _worker_throttle
+    chunks = []
+    buf = b""
+    pos = 0
+    eof = False
+    with open(file_path, "rb") as f:
+        while True:
+            # Keep at least one maximum-size chunk buffered
+            if not eof and len(buf) - pos < CDC_MAX_CHUNK:
+                block = f.read(1024 * 1024)
+                if block:
+                    buf = buf[pos:] + block
+                    pos = 0
+                    if throttle is not None:
+                        throttle.consume(len(block))
+                    continue
+                eof = True
+            if pos >= len(buf):
+                break
+
+            end = min(len(buf), pos + CDC_MAX_CHUNK)
+            cut = end
+            h = 0
+            for i in range(pos + CDC_MIN_CHUNK, end):
+                h = ((h << 1) + gear[buf[i]]) & 0xFFFFFFFFFFFFFFFF
+                if not h & mask:
+                    cut = i + 1
+                    break
+            chunks.append((xxhash.xxh64_intdigest(buf[pos:cut]), cut - pos))
+            pos = cut
+    return chunks
@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import statistics
+import subprocess
+import multiprocessing
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(HERE, "backup_cleaner.py")
+
+def run_python(code, runs):
+    """Run code in fresh interpreters; returns the median of the seconds each run prints."""
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", code], cwd=HERE, capture_output=True, text=True)
+        if output.returncode != 0:
+            return None, output.stderr.strip().splitlines()[-1]
+        timings.append(float(output.stdout.split()[0]))
+    return statistics.median(timings), None
+
+def probe_worker():
+    """Task of the worker benchmark: which of the heavy modules the worker has loaded."""
+    return [name for name in ("tkinter", "backup_cleaner") if name in sys.modules]
+
+def benchmark_gui(runs):
+    """Import time of the GUI module and time until the window is drawn."""
+    seconds, error = run_python(
+        "import time; t = time.perf_counter(); import backup_cleaner; print(time.perf_counter() - t)", runs)
+    if seconds is None:
+        print(f"GUI: import backup_cleaner: failed ({error})")
+    else:
+        print(f"GUI: import backup_cleaner: {seconds * 1000:.1f} ms")
+
+    seconds, error = run_python(
+        "import time; t = time.perf_counter(); import backup_cleaner; app = backup_cleaner.BackupCleaner(); "
+        "app.update(); print(time.perf_counter() - t); app.destroy()", runs)
+    if seconds is None:
+        print(f"GUI: first window: skipped ({error})")
+    else:
+        print(f"GUI: import and first window: {seconds * 1000:.1f} ms")
+
+def benchmark_workers(runs):
+    """Time from starting a one-process pool until its first task is done, per start method."""
+    # Fork workers inherit the modules of the parent, which has the GUI loaded
+    import backup_cleaner  # noqa: F401
+    import backup_worker
+    for method in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context(method)
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            with context.Pool(1, initializer=backup_worker.init_worker, initargs=(None, None)) as pool:
+                loaded = pool.apply(probe_worker)
+                timings.append(time.perf_counter() - start)
+        print(f"Worker ({method}): first task after {statistics.median(timings) * 1000:.1f} ms, "
+              f"loaded: {', '.join(loaded) or 'no GUI modules'}")
+
+    # Spawned workers of the application also run backup_cleaner.py as __mp_main__
+    seconds, error = run_python(
+        "import time, runpy, sys; t = time.perf_counter(); "
+        f"runpy.run_path({SCRIPT!r}, run_name='__mp_main__'); import backup_worker; "
+        "print(time.perf_counter() - t, 'tkinter' in sys.modules)", runs)
+    if seconds is None:
+        print(f"Worker (spawn): backup_cleaner.py as __mp_main__: failed ({error})")
+    else:
+        print(f"Worker (spawn): backup_cleaner.py as __mp_main__ and backup_worker: {seconds * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(f"Median of {runs} runs")
+    benchmark_gui(runs)
+    benchmark_workers(runs)
@@ -0,0 +1,652 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import backup_worker
+from backup_cleaner import BackupCleaner, FilterRules
+
+
+def make_tree(root):
+    """Create a small tree: t/a/b, t/c, with a few files."""
+    for rel_dir in ("a/b", "c"):
+        os.makedirs(os.path.join(root, rel_dir))
+    for rel_path in ("top.txt", "a/one.txt", "a/b/two.txt", "c/three.txt", "c/four.txt"):
+        with open(os.path.join(root, rel_path), "w") as f:
+            f.write(rel_path)
+
+
+def sorted_os_walk(top, topdown=True):
+    return sorted((root, sorted(dirs), sorted(files)) for root, dirs, files in os.walk(top, topdown=topdown))
+
+
+def test_parallel_walk_matches_os_walk(tmp_path):
+    top = str(tmp_path / "t")
+    make_tree(top)
+
+    expected = sorted_os_walk(top)
+    for threads in (1, 4, 32):
+        walked = list(BackupCleaner.parallel_walk(top, threads=threads))
+        assert sorted(walked) == expected
+        # Deterministic order regardless of the number of threads
+        assert walked == list(BackupCleaner.parallel_walk(top, threads=1, max_in_flight=1))
+
+
+def test_parallel_walk_bottom_up_lists_children_first(tmp_path):
+    top = str(tmp_path / "t")
+    make_tree(top)
+
+    walked = list(BackupCleaner.parallel_walk(top, topdown=False))
+    assert sorted(walked) == sorted_os_walk(top, topdown=False)
+
+    position = {root: i for i, (root, _, _) in enumerate(walked)}
+    for root, dirs, _ in walked:
+        for name in dirs:
+            assert position[os.path.join(root, name)] < position[root]
+
+
+def test_parallel_walk_prunes_in_place(tmp_path):
+    top = str(tmp_path / "t")
+    make_tree(top)
+
+    roots = []
+    for root, dirs, _ in BackupCleaner.parallel_walk(top):
+        dirs[:] = [name for name in dirs if name != "a"]
+        roots.append(root)
+    assert roots == [top, os.path.join(top, "c")]
+
+
+def test_filter_rules_prune_excluded_directories(tmp_path):
+    top = str(tmp_path / "t")
+    make_tree(top)
+    os.makedirs(os.path.join(top, "a", "node_modules"))
+    with open(os.path.join(top, "a", "node_modules", "big.js"), "w") as f:
+        f.write("x" * 100)
+
+    rules = FilterRules(exclude=FilterRules.parse_patterns("node_modules; c/*; re:two"), min_size=1)
+    walked = [(root, files) for root, _, files in BackupCleaner.walk_filtered(top, rules)]
+
+    # node_modules is pruned; "c/*" matches the files in c, not c itself
+    assert [os.path.relpath(root, top) for root, _ in walked] == [".", "a", os.path.join("a", "b"), "c"]
+    assert sum(len(files) for _, files in walked) == 2
+    assert rules.skipped["exclude node_modules"]["dirs"] == 1
+    assert rules.skipped["exclude c/*"]["files"] == 2
+    assert rules.skipped["exclude re:two"] == {"files": 1, "bytes": len("a/b/two.txt"), "dirs": 0}
+
+
+def test_excluded_directories_are_never_listed(tmp_path, monkeypatch):
+    top = str(tmp_path / "t")
+    make_tree(top)
+    for rel_dir in ("node_modules/pkg", "a/node_modules/deep/er"):
+        os.makedirs(os.path.join(top, rel_dir))
+
+    listed = []
+    list_directory = BackupCleaner._list_directory
+
+    def spy(path, with_stats=False):
+        listed.append(path)
+        return list_directory(path, with_stats)
+
+    monkeypatch.setattr(BackupCleaner, "_list_directory", staticmethod(spy))
+    rules = FilterRules(exclude=FilterRules.parse_patterns("node_modules"))
+    walked = [root for root, _, _ in BackupCleaner.walk_filtered(top, rules)]
+
+    assert not any("node_modules" in path for path in listed)
+    assert sorted(listed) == sorted(walked)
+    assert rules.skipped["exclude node_modules"]["dirs"] == 2
+
+
+def test_near_duplicate_similarity(tmp_path):
+    data = os.urandom(256 * 1024)
+    edited = data[:100000] + b"inserted" + data[100000:]
+    origin = tmp_path / "origin.bin"
+    target = tmp_path / "target.bin"
+    origin.write_bytes(edited)
+    target.write_bytes(data)
+
+    chunks = backup_worker.content_chunks(str(origin))
+    assert sum(length for _, length in chunks) == len(edited)
+    assert all(length <= 64 * 1024 for _, length in chunks)
+
+    # An insertion only changes the chunk around it
+    result = {"size": len(edited), "match_type": "Name match"}
+    redundant = BackupCleaner.score_near_duplicates([(result, chunks)], dict(backup_worker.content_chunks(str(target))))
+    assert result["similarity"] >= 80
+    assert result["match_type"] == f"Name match ({result['similarity']}% similar)"
+    assert len(edited) - 128 * 1024 < redundant < len(edited)
+
+
+def test_manifest_round_trip_and_index(tmp_path):
+    top = str(tmp_path / "t")
+    make_tree(top)
+    rules = FilterRules(exclude=["c"])
+    expected = BackupCleaner.build_target_index(top, rules)
+
+    for ext in (".csv", ".jsonl", ".sqlite"):
+        manifest_path = str(tmp_path / f"manifest{ext}")
+        assert BackupCleaner.write_manifest(top, manifest_path, workers=2) == 5
+        manifest = BackupCleaner.load_manifest(manifest_path)
+        size, mtime_ns, digest = manifest[os.path.join("a", "b", "two.txt")]
+        assert size == len("a/b/two.txt")
+        assert digest == backup_worker.calculate_checksum(os.path.join(top, "a", "b", "two.txt"))
+        assert BackupCleaner.build_target_index(top, FilterRules(exclude=["c"]), manifest) == expected
+
+
+def test_compare_with_manifest_does_not_read_target(tmp_path):
+    origin = str(tmp_path / "o")
+    target = str(tmp_path / "t")
+    make_tree(origin)
+    make_tree(target)
+    manifest_path = str(tmp_path / "manifest.jsonl")
+    BackupCleaner.write_manifest(target, manifest_path, workers=1)
+    manifest = BackupCleaner.load_manifest(manifest_path)
+    index = BackupCleaner.build_target_index(target, manifest=manifest)
+
+    # The comparison only uses the manifest, even if the target is not reachable
+    os.rename(target, target + ".offline")
+    params = dict(origin_folder=origin, target_folder=target, search_different_locations=False,
+                  **BackupCleaner.publish_target_index(index, manifest))
+    try:
+        results = backup_worker.process_file_batch(([os.path.join(origin, "a", "one.txt")], params, [None], [False]))
+    finally:
+        os.remove(params["index_path"])
+    assert [(r["match_type"], r["action"]) for r in results] == [("Exact match", "Delete")]
+
+
+def test_tree_hash_is_stable_and_covers_every_byte(tmp_path):
+    path = tmp_path / "big.bin"
+    data = bytearray(os.urandom(1000 * 1024))
+    path.write_bytes(bytes(data))
+
+    digests = {backup_worker.tree_hash(str(path), len(data), range_size=64 * 1024, threads=threads)
+               for threads in (1, 3, 8)}
+    assert len(digests) == 1
+
+    # A change anywhere in the file (not only in sampled regions) changes the digest
+    data[300 * 1024] ^= 1
+    path.write_bytes(bytes(data))
+    assert backup_worker.tree_hash(str(path), len(data), range_size=64 * 1024) not in digests
+
+
+def test_compare_reuses_scan_stats(tmp_path, monkeypatch):
+    origin = str(tmp_path / "o")
+    target = str(tmp_path / "t")
+    make_tree(origin)
+    make_tree(target)
+    origin_stats = {}
+    target_stats = {}
+    files = [os.path.join(root, name) for root, _, names in BackupCleaner.walk_filtered(origin, file_stats=origin_stats)
+             for name in names]
+    index = BackupCleaner.build_target_index(target, file_stats=target_stats)
+    scanned = {os.path.relpath(path, target): stat + (None,) for path, stat in target_stats.items()}
+    assert len(files) == len(origin_stats) == len(scanned) == 5
+
+    params = dict(origin_folder=origin, target_folder=target, search_different_locations=False,
+                  **BackupCleaner.publish_target_index(index, scanned))
+    stat_calls = []
+    real_stat = os.stat
+    monkeypatch.setattr(os, "stat", lambda *a, **k: stat_calls.append(a) or real_stat(*a, **k))
+    try:
+        results = backup_worker.process_file_batch((files, params, [origin_stats[path] for path in files], [False] * 5))
+    finally:
+        os.remove(params["index_path"])
+
+    assert stat_calls == []
+    assert all(result["match_type"] == "Exact match" for result in results)
+    # Origin stat, target stat and both checksum stats, for each file
+    assert sum(result["stat_calls_saved"] for result in results) == 4 * 5
+
+
+def test_plan_is_grouped_by_directory_and_creates_each_once(tmp_path, monkeypatch):
+    origin = str(tmp_path / "o")
+    target = str(tmp_path / "t")
+    rows = []
+    for i in range(6):
+        rel_dir = "x" if i % 2 else "y"
+        os.makedirs(os.path.join(origin, rel_dir), exist_ok=True)
+        path = os.path.join(origin, rel_dir, f"f{i}.txt")
+        with open(path, "w") as f:
+            f.write("data")
+        rows.append({"action": "Move", "origin_path": path, "target_path": None, "size": 4})
+
+    plan = BackupCleaner.plan_actions(rows, origin, target)
+    assert [entry["seq"] for entry in plan] == list(range(6))
+    assert [os.path.basename(os.path.dirname(entry["dest_path"])) for entry in plan] == ["x"] * 3 + ["y"] * 3
+
+    created = []
+    real_makedirs = os.makedirs
+    monkeypatch.setattr(os, "makedirs", lambda path, *a, **k: created.append(path) or real_makedirs(path, *a, **k))
+    known_dirs = set()
+    for entry in plan:
+        BackupCleaner._perform_action(entry, known_dirs=known_dirs)
+    # (makedirs also calls itself for the missing parent)
+    assert sorted(created) == [target, os.path.join(target, "x"), os.path.join(target, "y")]
+    assert sorted(os.listdir(os.path.join(target, "x"))) == ["f1.txt", "f3.txt", "f5.txt"]
+
+
+def test_verified_copy_matches_compare_digest(tmp_path, monkeypatch):
+    import backup_cleaner
+
+    src = tmp_path / "src.bin"
+    src.write_bytes(os.urandom(300 * 1024))
+    dst = str(tmp_path / "dst.bin")
+    BackupCleaner._verified_copy(str(src), dst, backup_worker.calculate_checksum(str(src)))
+    assert open(dst, "rb").read() == src.read_bytes()
+
+    # Large files are verified against the tree hash, ranges spanning buffer boundaries
+    monkeypatch.setattr(backup_cleaner, "TREE_HASH_MIN_SIZE", 100 * 1024)
+    monkeypatch.setattr(backup_cleaner, "TREE_HASH_RANGE_SIZE", 48 * 1024)
+    monkeypatch.setattr(backup_cleaner, "COPY_BUFFER_SIZE", 40 * 1024)
+    tree_digest = backup_worker.tree_hash(str(src), 300 * 1024, range_size=48 * 1024)
+    BackupCleaner._verified_copy(str(src), dst, tree_digest)
+
+    # A file that changed since the comparison is not copied, and the original is kept
+    entry = {"action": "Copy as _v2", "origin_path": str(src), "dest_path": dst, "size": 0, "digest": "0" * 16}
+    os.remove(dst)
+    with pytest.raises(ValueError):
+        BackupCleaner._perform_action(entry)
+    assert src.exists() and not os.path.exists(dst)
+
+
+def test_origin_duplicates_keep_one_copy(tmp_path):
+    origin = str(tmp_path / "o")
+    target = str(tmp_path / "t")
+    os.makedirs(os.path.join(origin, "import1"))
+    os.makedirs(os.path.join(origin, "import2"))
+    os.makedirs(target)
+    paths = [os.path.join(origin, "import1", "a.jpg"), os.path.join(origin, "import2", "a.jpg"),
+             os.path.join(origin, "import2", "b.jpg")]
+    for path in paths:
+        with open(path, "w") as f:
+            f.write("same photo")
+
+    params = dict(origin_folder=origin, target_folder=target, search_different_locations=False,
+                  target_index=BackupCleaner.build_target_index(target))
+    results = backup_worker.process_file_batch((paths, params, [None] * 3, [True] * 3))
+    results = BackupCleaner.mark_origin_duplicates(results)
+    assert [(r["match_type"], r["action"]) for r in results] == [
+        ("No match", "Move"),
+        ("Duplicate within origin (3 copies)", "Delete"),
+        ("Duplicate within origin (3 copies)", "Delete"),
+    ]
+    assert results[1]["target_path"] == paths[0]
+
+    # The duplicates may only be deleted once the kept copy is in place
+    for result in results:
+        result["selected"] = True
+    plan = BackupCleaner.plan_actions(results, origin, target)
+    for entry in plan:
+        BackupCleaner._perform_action(entry)
+    assert not any(os.path.exists(path) for path in paths)
+    assert os.listdir(os.path.join(target, "import1")) == ["a.jpg"]
+
+
+def test_quick_mode_classifies_from_metadata(tmp_path, monkeypatch):
+    origin = str(tmp_path / "o")
+    target = str(tmp_path / "t")
+    make_tree(origin)
+    make_tree(target)
+    with open(os.path.join(origin, "c", "four.txt"), "w") as f:
+        f.write("a longer, changed version")
+    origin_stats = {}
+    target_stats = {}
+    files = [os.path.join(root, name) for root, _, names in BackupCleaner.walk_filtered(origin, file_stats=origin_stats)
+             for name in names]
+    index = BackupCleaner.build_target_index(target, file_stats=target_stats)
+    scanned = {os.path.relpath(path, target): stat + (None,) for path, stat in target_stats.items()}
+
+    # No file is read in quick mode
+    monkeypatch.setattr(backup_worker, "calculate_checksum", None)
+    params = dict(origin_folder=origin, target_folder=target, search_different_locations=False,
+                  metadata_only=True, target_index=index, manifest=scanned)
+    results = backup_worker.process_file_batch(
+        (files, params, [origin_stats[path] for path in files], [False] * len(files)))
+    by_name = {os.path.basename(r["origin_path"]): r for r in results}
+
+    assert by_name["four.txt"]["match_type"] == "Name match"
+    assert by_name["four.txt"]["reclaimable"] == 0
+    assert by_name["one.txt"]["action"] == "Verify"
+    assert by_name["one.txt"]["match_type"] in ("Likely exact match (unverified)", "Size match (unverified)")
+    assert by_name["one.txt"]["reclaimable"] == len("a/one.txt")
+    assert all(r["provisional"] for r in results)
+
+
+def test_encoded_results_round_trip(tmp_path):
+    import json
+
+    origin = str(tmp_path / "o")
+    target = str(tmp_path / "t")
+    make_tree(origin)
+    make_tree(target)
+    # Several candidates for one file, a changed file and a file without match
+    for name, content in (("one - Copy.txt", "a/one.txt"), ("one (1).txt", "other"), ("one_v2.txt", "xxxxxxxxx")):
+        with open(os.path.join(target, "a", name), "w") as f:
+            f.write(content)
+    with open(os.path.join(origin, "c", "four.txt"), "w") as f:
+        f.write("changed")
+    with open(os.path.join(origin, "new.txt"), "w") as f:
+        f.write("new")
+    files = sorted(os.path.join(root, name) for root, _, names in os.walk(origin) for name in names)
+    params = dict(origin_folder=origin, target_folder=target, search_different_locations=False,
+                  target_index=BackupCleaner.build_target_index(target))
+    args = (files, params, [None] * len(files), [True] * len(files))
+
+    results = backup_worker.process_file_batch(args)
+    encoded = backup_worker.process_file_batch_encoded(args)
+    assert encoded["stat_calls_saved"] == sum(result.pop("stat_calls_saved", 0) for result in results)
+    assert {r["match_type"] for r in results} >= {"Exact match (multiple matches: 3)", "Alternative match #2", "No match"}
+
+    assert backup_worker.decode_results(encoded, files, target) == results
+    as_json = json.loads(json.dumps(backup_worker.encoded_to_json(encoded)))
+    assert backup_worker.decode_results(as_json, files, target) == results
+
+
+def test_merge_walk_joins_trees_by_relative_path(tmp_path):
+    origin, target = tmp_path / "origin", tmp_path / "target"
+    for root, rel_paths in ((origin, ("a/x.txt", "a/y.txt", "b/z.txt", "skip/s.txt", "top.txt")),
+                            (target, ("a/y.txt", "a/w.txt", "c/v.txt", "skip/s.txt", "top.txt"))):
+        for rel_path in rel_paths:
+            (root / rel_path).parent.mkdir(parents=True, exist_ok=True)
+            (root / rel_path).write_text(rel_path)
+    rules = FilterRules(exclude=FilterRules.parse_patterns("skip"))
+
+    joined = [(rel_path.replace(os.sep, "/"), origin_stat is not None, target_stat is not None)
+              for rel_path, origin_stat, target_stat
+              in BackupCleaner.merge_walk(str(origin), str(target), rules, rules)]
+    assert joined == [
+        ("top.txt", True, True),
+        ("a/w.txt", False, True),
+        ("a/x.txt", True, False),
+        ("a/y.txt", True, True),
+        ("b/z.txt", True, False),
+        ("c/v.txt", False, True),
+    ]
+
+    # Pairs are compared at their relative path only
+    params = {
+        'origin_folder': str(origin),
+        'target_folder': str(target),
+        'search_different_locations': False,
+        'same_layout': True,
+        'target_index': {},
+        'manifest': {os.path.join("a", "y.txt"): (os.path.getsize(target / "a" / "y.txt"), 0, None)}
+    }
+    batch = [str(origin / "a" / "x.txt"), str(origin / "a" / "y.txt")]
+    results = backup_worker.process_file_batch((batch, params, [None, None], [True, True]))
+    assert [result['match_type'] for result in results] == ["No match", "Exact match"]
+
+
+def test_sharded_compare_merges_to_single_shard_result(tmp_path):
+    origin, target = tmp_path / "origin", tmp_path / "target"
+    files = {
+        "same/a.txt": ("alpha", "alpha"),
+        "same/b.txt": ("beta", "beta"),
+        "changed/c.txt": ("gamma", "GAMMA"),
+        "new/d.txt": ("delta", None),
+        "new/deeper/d copy.txt": ("delta", None),
+        "top.txt": ("top", "top"),
+    }
+    for rel_path, (origin_content, target_content) in files.items():
+        for root, content in ((origin, origin_content), (target, target_content)):
+            if content is not None:
+                (root / rel_path).parent.mkdir(parents=True, exist_ok=True)
+                (root / rel_path).write_text(content)
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backup_cleaner.py")
+
+    def run_sharded(shards):
+        shard_files = [str(tmp_path / f"shard{shards}_{shard}.jsonl") for shard in range(shards)]
+        # Each shard is an independent process, as on separate hosts
+        jobs = [subprocess.Popen([sys.executable, script, "shard", str(origin), str(target), shard_file,
+                                  "--shard", str(shard), "--shards", str(shards), "--workers", "1"])
+                for shard, shard_file in enumerate(shard_files)]
+        assert [job.wait(timeout=120) for job in jobs] == [0] * shards
+        session = str(tmp_path / f"session{shards}.jsonl")
+        BackupCleaner.merge_shards(shard_files, session)
+        header, rows = BackupCleaner.load_session(session)
+        assert header["files"] == 6
+        return sorted((row["origin_path"], row["match_type"], row["action"]) for row in rows)
+
+    assert {BackupCleaner.shard_of(rel_path, 3) for rel_path in files} != {0}
+    single = run_sharded(1)
+    assert single == run_sharded(3)
+    match_types = {os.path.relpath(path, origin).replace(os.sep, "/"): match_type for path, match_type, _ in single}
+    assert match_types["same"].startswith("Exact match (directory")
+    assert match_types["new/deeper/d copy.txt"].startswith("Duplicate within origin")
+
+    with pytest.raises(ValueError, match="Missing shards"):
+        BackupCleaner.merge_shards([str(tmp_path / "shard3_0.jsonl")], str(tmp_path / "partial.jsonl"))
+
+
+def test_workers_do_not_load_the_gui():
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backup_cleaner.py")
+    # Pool tasks only use backup_worker; spawned workers also run the script as __mp_main__
+    for code in ("import backup_worker",
+                 f"import runpy; runpy.run_path({script!r}, run_name='__mp_main__')"):
+        output = subprocess.run([sys.executable, "-c", code + "; import sys; print('tkinter' in sys.modules)"],
+                                cwd=os.path.dirname(script), capture_output=True, text=True, check=True).stdout
+        assert output.strip() == "False"
+
+
+def test_checkpoint_keeps_only_last_comparison_of_a_file(tmp_path):
+    import json
+
+    origin = str(tmp_path / "o")
+    target = str(tmp_path / "t")
+    make_tree(origin)
+    make_tree(target)
+    path = os.path.join(origin, "a", "one.txt")
+    params = dict(origin_folder=origin, target_folder=target, search_different_locations=False)
+    checkpoint_path = BackupCleaner.open_checkpoint(str(tmp_path / "checkpoint.jsonl"), params)
+
+    def checkpoint_batch():
+        batch_params = dict(params, target_index=BackupCleaner.build_target_index(target))
+        encoded = backup_worker.process_file_batch_encoded(([path], batch_params, [None], [False]))
+        with open(checkpoint_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"files": [path], "encoded": backup_worker.encoded_to_json(encoded)}) + "\n")
+
+    # Checkpointed as an exact match, then changed and compared again after a resume
+    checkpoint_batch()
+    with open(path, "w") as f:
+        f.write("changed after the checkpoint")
+    checkpoint_batch()
+    # A truncated last line is ignored
+    with open(checkpoint_path, "a", encoding="utf-8") as f:
+        f.write('{"files": ["')
+
+    done_files, results = BackupCleaner.load_checkpoint(checkpoint_path)
+    assert done_files == {path}
+    assert [(r["match_type"], r["action"]) for r in results] == [("Name match", "Copy as _v2")]
+    assert BackupCleaner.validate_checkpoint_results(results) == {path}
+
+
+def test_journal_resumes_after_truncated_last_line(tmp_path):
+    from backup_cleaner import ActionJournal
+
+    origin = tmp_path / "o"
+    target = tmp_path / "t"
+    origin.mkdir()
+    plan = []
+    for seq, name in enumerate(("a.txt", "b.txt", "c.txt")):
+        (origin / name).write_text(name)
+        plan.append({"seq": seq, "action": "Move", "origin_path": str(origin / name),
+                     "dest_path": str(target / name), "size": len(name)})
+    journal_path = str(tmp_path / "journal.jsonl")
+
+    # The first move completes and is recorded, the second completes but the
+    # crash happens while its record is written
+    journal = ActionJournal.create(journal_path, str(origin), str(target), plan)
+    BackupCleaner._perform_action(plan[0])
+    journal.record(0, "done")
+    BackupCleaner._perform_action(plan[1])
+    journal.close()
+    with open(journal_path, "a", encoding="utf-8") as f:
+        f.write('{"op": "done", "se')
+
+    journal = ActionJournal.load(journal_path)
+    assert (journal.origin_folder, journal.target_folder) == (str(origin), str(target))
+    assert journal.plan == plan
+    assert journal.done == {0}
+
+    # Resuming runs the remaining entries; the one already done on disk is skipped
+    for entry in journal.plan:
+        if entry["seq"] not in journal.done:
+            BackupCleaner._perform_action(entry)
+            journal.record(entry["seq"], "done")
+    journal.close()
+    assert sorted(os.listdir(target)) == ["a.txt", "b.txt", "c.txt"]
+    assert os.listdir(origin) == []
+    assert ActionJournal.load(journal_path).done == {0, 1, 2}
+
+
+def test_resumed_delete_keeps_last_copy_check(tmp_path):
+    from backup_cleaner import ActionJournal
+
+    origin = tmp_path / "o"
+    target = tmp_path / "t"
+    origin.mkdir()
+    target.mkdir()
+    (origin / "a.txt").write_text("same")
+    (target / "a.txt").write_text("same")
+    plan = [{"seq": 0, "action": "Delete", "origin_path": str(origin / "a.txt"), "dest_path": None,
+             "size": 4, "keep_paths": [str(target / "a.txt")]}]
+    journal_path = str(tmp_path / "journal.jsonl")
+    ActionJournal.create(journal_path, str(origin), str(target), plan).close()
+
+    journal = ActionJournal.load(journal_path)
+    journal.close()
+    assert journal.plan == plan
+
+    # The matching copy disappeared while the plan was interrupted
+    (target / "a.txt").unlink()
+    with pytest.raises(ValueError, match="Matching file missing or changed"):
+        BackupCleaner._perform_action(journal.plan[0])
+    assert (origin / "a.txt").exists()
+
+
+def test_resumed_copy_is_verified_against_digest(tmp_path):
+    from backup_cleaner import ActionJournal
+
+    origin = tmp_path / "o"
+    target = tmp_path / "t"
+    origin.mkdir()
+    (origin / "a.txt").write_text("compared content")
+    plan = [{"seq": 0, "action": "Copy as _v2", "origin_path": str(origin / "a.txt"),
+             "dest_path": str(target / "a_v2.txt"), "size": 16,
+             "digest": backup_worker.calculate_checksum(str(origin / "a.txt"))}]
+    journal_path = str(tmp_path / "journal.jsonl")
+    ActionJournal.create(journal_path, str(origin), str(target), plan).close()
+
+    journal = ActionJournal.load(journal_path)
+    journal.close()
+    assert journal.plan == plan
+
+    # The file changed while the plan was interrupted; the copy is rejected
+    (origin / "a.txt").write_text("modified content")
+    with pytest.raises(ValueError):
+        BackupCleaner._perform_action(journal.plan[0])
+    assert (origin / "a.txt").exists()
+    assert not (target / "a_v2.txt").exists()
+
+
+def test_merkle_digests_cover_whole_subtrees():
+    j = os.path.join
+    digests = BackupCleaner.build_merkle_digests({
+        j("a", "x.txt"): "1", j("a", "sub", "y.txt"): "2",
+        j("b", "x.txt"): "1", j("b", "sub", "y.txt"): "2",
+        j("c", "x.txt"): "1", j("c", "sub", "z.txt"): "2",
+        j("d", "x.txt"): None,
+    })
+    # Same names and contents, at any depth, give the same digest
+    assert digests["a"] == digests["b"]
+    assert digests[j("a", "sub")] == digests[j("b", "sub")]
+    # A renamed file changes the digest of every ancestor
+    assert digests[j("c", "sub")] != digests[j("a", "sub")] and digests["c"] != digests["a"]
+    # Unknown digests propagate up to the root
+    assert digests["d"] is None and digests[""] is None
+
+
+def test_identical_directories_are_collapsed(tmp_path):
+    origin = str(tmp_path / "o")
+    target = str(tmp_path / "t")
+    make_tree(origin)
+    make_tree(target)
+    # An extra target file makes "c" (and the root) differ
+    with open(os.path.join(target, "c", "extra.txt"), "w") as f:
+        f.write("only in target")
+    index = BackupCleaner.build_target_index(target)
+    files = sorted(os.path.join(root, name) for root, _, names in os.walk(origin) for name in names)
+    params = dict(origin_folder=origin, target_folder=target, search_different_locations=False, target_index=index)
+    results = backup_worker.process_file_batch((files, params, [None] * len(files), [False] * len(files)))
+
+    target_rel_paths = [rel_path for paths in index.values() for rel_path in paths]
+    rows = BackupCleaner.collapse_identical_directories(results, files, origin, target, target_rel_paths)
+    by_path = {os.path.relpath(row["origin_path"], origin): row for row in rows}
+    assert sorted(by_path) == sorted(["a", os.path.join("c", "four.txt"), os.path.join("c", "three.txt"), "top.txt"])
+    assert by_path["a"]["action"] == "Delete directory"
+    assert by_path["a"]["match_type"] == "Exact match (directory, 2 files)"
+    assert sorted(path for path, _ in by_path["a"]["members"]) == [
+        os.path.join(origin, "a", "b", "two.txt"), os.path.join(origin, "a", "one.txt")]
+    assert by_path[os.path.join("c", "three.txt")]["action"] == "Delete"
+
+
+def test_analyze_plan_estimates_cost_per_device_pair(tmp_path):
+    origin = tmp_path / "o"
+    target = tmp_path / "t"
+    origin.mkdir()
+    target.mkdir()
+    plan = [
+        {"seq": 0, "action": "Move", "origin_path": str(origin / "a"), "dest_path": str(target / "a"), "size": 10},
+        {"seq": 1, "action": "Copy as _v2", "origin_path": str(origin / "b"),
+         "dest_path": str(target / "new" / "b_v2"), "size": 700 * 1024 * 1024},
+        {"seq": 2, "action": "Delete", "origin_path": str(origin / "c"), "dest_path": None, "size": 5},
+    ]
+    device = os.stat(tmp_path).st_dev
+    pair_key = f"{device}->{device}"
+    history = {"pairs": {pair_key: 1024 * 1024}, "metadata_ops_per_second": 100}
+
+    estimate = BackupCleaner.analyze_plan(plan, history)
+    # A move on one device is a rename; copies are costed with the measured throughput
+    assert [entry["mode"] for entry in plan] == ["rename", "copy", "delete"]
+    assert estimate["bytes_per_action"] == {"Move": 10, "Copy as _v2": 700 * 1024 * 1024, "Delete": 5}
+    assert estimate["metadata_ops"] == 2
+    pair = estimate["pairs"][pair_key]
+    assert (pair["files"], pair["measured"], pair["seconds"]) == (1, True, 700)
+    assert estimate["seconds"] == pytest.approx(700 + 2 / 100)
+    # Ten minutes of copying at 1 MB/s is flagged
+    assert any("slow disk" in warning for warning in estimate["warnings"])
+
+    # Without history, the default throughput is assumed
+    unmeasured = BackupCleaner.analyze_plan(plan, {})["pairs"][pair_key]
+    assert not unmeasured["measured"] and unmeasured["seconds"] < pair["seconds"]
+
+
+def test_io_throttle_token_buckets(monkeypatch):
+    clock = [1000.0]
+    sleeps = []
+    monkeypatch.setattr(backup_worker.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(backup_worker.time, "sleep", sleeps.append)
+
+    throttle = backup_worker.IOThrottle()
+    assert not throttle.is_limited()
+    throttle.consume(10 ** 9, 10 ** 6)
+    assert sleeps == []
+
+    throttle.set_limits(100, 10)
+    assert throttle.is_limited()
+    # A full bucket (one second worth) is available right away
+    throttle.consume(100, 1)
+    assert sleeps == []
+    # Going into debt sleeps until it is paid back
+    throttle.consume(50, 1)
+    assert sleeps == [pytest.approx(0.5)]
+    # Refills are capped at one second worth of tokens
+    clock[0] += 10
+    throttle.consume(100, 10)
+    assert len(sleeps) == 1
+    throttle.consume(0, 5)
+    assert sleeps[-1] == pytest.approx(0.5)
+
+    throttle.set_limits(0, 0)
+    assert not throttle.is_limited()